@@ -26,7 +26,7 @@ import random
 import concurrent.futures
 # from serpapi import GoogleSearch
 from fpdf import FPDF
-import google.generativeai as genai
+from google import genai
 from langchain_google_genai import GoogleGenerativeAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
@@ -34,6 +34,13 @@ from transformers import pipeline
 from textblob import TextBlob
 import re
 import pickle
+import sys
+
+# Share the quota-aware key pool and per-key clients with the main server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from key_pool import create_key_pool, PerKeyCache, LeasedChain
+from http_client import gemini_http_options
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -66,9 +73,27 @@ COMPOSIO_API_KEY = os.environ.get("COMPOSIO_API_KEY", "YOUR_COMPOSIO_API_KEY")
 SERP_API_KEY = os.environ.get("SERP_API_KEY", "db997ee3c393ed490769c69d9e7dfe434efd62c9b2372ad73d470266124f9cbb")
 EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD", "YOUR_EMAIL_PASSWORD")
 
-# Function to get a random API key
-def get_random_gemini_key():
-    return random.choice(GEMINI_API_KEYS)
+# Tracks per-key budgets, latency and cooldowns; shared by every worker process via KEY_POOL_PATH
+key_pool = create_key_pool(GEMINI_API_KEYS)
+
+# Request timeout (seconds) for google.genai calls; image generation can be slow
+GEMINI_HTTP_TIMEOUT = float(os.environ.get("GEMINI_HTTP_TIMEOUT", 120))
+
+# One LangChain LLM and one google.genai client per key, built on first use and
+# reused by every request, so nothing touches the global genai.configure state
+gemini_llms = PerKeyCache(lambda api_key: GoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key))
+gemini_clients = PerKeyCache(
+    lambda api_key: genai.Client(api_key=api_key, http_options=gemini_http_options(GEMINI_HTTP_TIMEOUT))
+)
+
+def build_pooled_chain(spec):
+    """Key-leasing chain for (input_variables, template), with one LLMChain per key"""
+    prompt = PromptTemplate(input_variables=list(spec[0]), template=spec[1])
+    chains = PerKeyCache(lambda api_key: LLMChain(llm=gemini_llms.get(api_key), prompt=prompt))
+    return LeasedChain(key_pool, chains.get)
+
+# One chain per prompt, shared by every request
+pooled_chains = PerKeyCache(build_pooled_chain)
 
 
 class TweetMetricsAnalyzer:
@@ -220,27 +245,7 @@ class EnhancedViralThreadGenerator:
         self.tweet_metrics = TweetMetricsAnalyzer()
         self.style_analyzer = TwitterStyleAnalyzer()
         self.setup_prompts()
-        self.api_key_index = 0
         
-    def get_next_api_key(self):
-        """Get the next API key using round-robin"""
-        key = GEMINI_API_KEYS[self.api_key_index]
-        self.api_key_index = (self.api_key_index + 1) % len(GEMINI_API_KEYS)
-        return key
-        
-    def get_llm(self):
-        """Get a Gemini LLM instance with a fresh API key"""
-        api_key = get_random_gemini_key()
-        try:
-            genai.configure(api_key=api_key)
-            return GoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key)
-        except Exception as e:
-            logger.error(f"Error initializing LLM with key {api_key}: {str(e)}")
-            # Try with another key if this one fails
-            api_key = self.get_next_api_key()
-            genai.configure(api_key=api_key)
-            return GoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key)
-
     def setup_prompts(self):
         self.hook_template = PromptTemplate(
             input_variables=["topic", "current_date"],
@@ -327,8 +332,8 @@ class EnhancedViralThreadGenerator:
         )
 
     def create_chain(self, prompt_template):
-        """Create a chain with a fresh LLM instance"""
-        return LLMChain(llm=self.get_llm(), prompt=prompt_template)
+        """Shared chain that leases a pooled key for every run"""
+        return pooled_chains.get((tuple(prompt_template.input_variables), prompt_template.template))
 
     def optimize_tweet(self, tweet):
         """Optimize a tweet for virality"""
@@ -370,20 +375,15 @@ class EnhancedViralThreadGenerator:
     def generate_image(self, prompt):
         """Generate an image using Gemini"""
         try:
-            api_key = get_random_gemini_key()
-            from google import genai
-            from google.genai import types
-            
-            client = genai.Client(api_key=api_key)
-            
-            # Generate content using the correct method and configuration
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp-image-generation",
-                contents=[prompt],
-                config=types.GenerateContentConfig(
-                    response_modalities=['Text', 'Image']
+            with key_pool.lease() as api_key:
+                # Generate content using the correct method and configuration
+                response = gemini_clients.get(api_key).models.generate_content(
+                    model="gemini-2.0-flash-exp-image-generation",
+                    contents=[prompt],
+                    config=types.GenerateContentConfig(
+                        response_modalities=['Text', 'Image']
+                    )
                 )
-            )
             print("hoo")
             for part in response.candidates[0].content.parts:
                 if hasattr(part, 'inline_data') and part.inline_data is not None:
@@ -522,10 +522,6 @@ class EnhancedViralThreadGenerator:
     def create_action_plan(self, topic, thread_data, schedule):
         """Generate an action plan based on the thread and insights"""
         try:
-            api_key = get_random_gemini_key()
-            genai.configure(api_key=api_key)
-            llm = GoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key)
-            
             # Extract tweet content
             tweets = [tweet["content"] for tweet in thread_data]
             tweets_text = "\n\n".join([f"Tweet {i+1}: {tweet}" for i, tweet in enumerate(tweets)])
@@ -566,7 +562,7 @@ class EnhancedViralThreadGenerator:
                 """
             )
             
-            action_plan_chain = LLMChain(llm=llm, prompt=action_plan_prompt)
+            action_plan_chain = self.create_chain(action_plan_prompt)
             action_plan = action_plan_chain.run(
                 topic=topic,
                 tweets=tweets_text,
@@ -320,7 +320,7 @@ function NewDashboard() {
                         
                         <p className="text-sm">{tweet.content}</p>
                         <img 
-                              src={`data:image/png;base64,${tweet.image}`} 
+                              src={tweet.image_url ? `${API_URL}${tweet.image_url}?w=640` : `data:image/png;base64,${tweet.image}`} 
                               alt="Generated content" 
                               className="rounded-md max-w-full h-auto"
                               onError={(e) => {
@@ -247,12 +247,20 @@ const ContentCreatorDashboard = () => {
     setCurrentPhase('generating');
   
     try {
-      const response = await axios.post('http://localhost:5005/generate', {
+      let response = await axios.post('http://localhost:5005/generate', {
         text: description,
       });
+      // Slow generations answer 202 with a job to poll until the result is ready
+      while (response.status === 202) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        response = await axios.get(`http://localhost:5005${response.data.status_url}`);
+      }
   
       if (response.data) {
-        setImg1(response.data.image1);
+        // Image URLs are served by the generator; older responses embed base64
+        setImg1(response.data.image1_url
+          ? `http://localhost:5005${response.data.image1_url}`
+          : response.data.image1 && `data:image/png;base64,${response.data.image1}`);
         setTweet(response.data.tweet);
         setCurrentPhase('preview');
       }
@@ -280,9 +288,9 @@ const ContentCreatorDashboard = () => {
     setCurrentPhase('posting');
     
     try {
-      // Convert base64 string to blob
-      const base64Response = await fetch(`data:image/png;base64,${img1}`);
-      const blob = await base64Response.blob();
+      // Fetch the image (URL or data URI) as a blob
+      const imageResponse = await fetch(img1);
+      const blob = await imageResponse.blob();
       
       // Create form data and append image as file
       const formData = new FormData();
@@ -522,7 +530,7 @@ const ContentCreatorDashboard = () => {
                         <div className="relative overflow-hidden rounded-lg h-40">
                           {img1 ? (
                             <img 
-                              src={`data:image/png;base64,${img1}`} 
+                              src={img1} 
                               alt="Generated Image" 
                               className="w-full h-full object-cover"
                             />
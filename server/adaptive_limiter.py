@@ -0,0 +1,218 @@
+# adaptive_limiter.py - Process-wide AIMD concurrency limit for Gemini calls
+
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+
+from key_pool import NoKeyAvailable, is_rate_limit_error
+
+logger = logging.getLogger(__name__)
+
+
+class LimiterTimeout(Exception):
+    """Waited too long for a concurrency slot"""
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted", "cancelled")
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+class AdaptiveLimiter:
+    """Caps in-flight calls with a limit that adapts to how the backend copes.
+
+    Additive increase: after a full limit's worth of healthy calls made while
+    at least half the slots are busy, the limit grows by one. Multiplicative decrease: a 429/503, or a short-term latency
+    EWMA rising above ``latency_tolerance`` times the long-term one while at
+    least half the slots are busy, cuts the limit by ``backoff`` (at most once
+    per ``decrease_interval`` seconds). Slow calls at low concurrency are
+    the backend's own variance, not congestion, so they don't shrink it.
+    Callers over the limit queue FIFO; threads block and coroutines await,
+    and both share the same slots.
+    """
+
+    def __init__(self, name, initial_limit=16, min_limit=2, max_limit=128, backoff=0.7,
+                 latency_tolerance=2.0, decrease_interval=1.0, queue_timeout=60):
+        self.name = name
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.decrease_interval = decrease_interval
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = deque()
+        self._healthy_streak = 0
+        self._last_decrease = 0.0
+        self._short_latency = None
+        self._long_latency = None
+        self._stats = {"calls": 0, "errors": 0, "rate_limited": 0, "increases": 0,
+                       "decreases": 0, "queue_timeouts": 0, "peak_in_flight": 0}
+
+    def _grant_waiters(self):
+        """Hand free slots to queued waiters; returns their wake callbacks (call outside the lock)"""
+        wakes = []
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self._in_flight += 1
+            wakes.append(waiter.wake)
+        self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+        return wakes
+
+    def _enter_or_queue(self, wake):
+        """Take a slot now (returns None) or enqueue a waiter and return it"""
+        with self._lock:
+            if self._in_flight < self.limit and not self._waiters:
+                self._in_flight += 1
+                self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+                return None
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter):
+        """A waiter gave up; returns True if it had already been granted a slot"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self._stats["queue_timeouts"] += 1
+            return False
+
+    def acquire(self, timeout=None):
+        """Block until a slot is free; raises LimiterTimeout after timeout seconds"""
+        event = threading.Event()
+        waiter = self._enter_or_queue(event.set)
+        if waiter is None:
+            return
+        if not event.wait(self.queue_timeout if timeout is None else timeout):
+            if not self._abandon(waiter):
+                raise LimiterTimeout(f"No {self.name} concurrency slot within {timeout or self.queue_timeout}s")
+
+    async def aacquire(self, timeout=None):
+        """Await a slot without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter_or_queue(wake)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(future, self.queue_timeout if timeout is None else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if self._abandon(waiter):
+                if isinstance(e, asyncio.CancelledError):
+                    # Granted just as we were cancelled; give the slot back
+                    self.release()
+                    raise
+                return
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise LimiterTimeout(f"No {self.name} concurrency slot within {timeout or self.queue_timeout}s")
+
+    def release(self, latency=None, error=None):
+        """Free a slot and adapt the limit to the call's outcome"""
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight = max(self._in_flight - 1, 0)
+            self._adapt(now, latency, error)
+            wakes = self._grant_waiters()
+        for wake in wakes:
+            wake()
+
+    def _decrease(self, now, reason):
+        if now - self._last_decrease < self.decrease_interval:
+            return
+        self._last_decrease = now
+        self._healthy_streak = 0
+        new_limit = max(self.min_limit, int(self.limit * self.backoff))
+        if new_limit < self.limit:
+            logger.warning(f"{self.name} concurrency limit {self.limit} -> {new_limit} ({reason})")
+            self.limit = new_limit
+            self._stats["decreases"] += 1
+
+    def _adapt(self, now, latency, error):
+        if latency is None and error is None:
+            return
+        if isinstance(error, NoKeyAvailable):
+            # Running out of keys says nothing about how the backend is coping
+            return
+        self._stats["calls"] += 1
+        if error is not None:
+            self._stats["errors"] += 1
+            if is_rate_limit_error(error):
+                self._stats["rate_limited"] += 1
+                self._decrease(now, "rate limited")
+            return
+
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+        else:
+            self._short_latency += 0.2 * (latency - self._short_latency)
+            self._long_latency += 0.02 * (latency - self._long_latency)
+
+        # _in_flight has already dropped this call, so add it back when judging load
+        saturated = self._in_flight + 1 >= self.limit / 2
+        if saturated and self._short_latency > self.latency_tolerance * self._long_latency:
+            self._decrease(now, "latency rising")
+            return
+
+        if not saturated:
+            # Headroom that isn't being used says nothing about whether more would be safe
+            return
+        self._healthy_streak += 1
+        if self._healthy_streak >= self.limit and self.limit < self.max_limit:
+            self._healthy_streak = 0
+            self.limit += 1
+            self._stats["increases"] += 1
+
+    @contextlib.contextmanager
+    def slot(self, measure=True):
+        """Hold a slot for the block; its duration and any error adapt the limit"""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(error=e)
+            raise
+        self.release(latency=time.monotonic() - start if measure else None)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, measure=True):
+        await self.aacquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(error=e)
+            raise
+        self.release(latency=time.monotonic() - start if measure else None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "queue_depth": sum(1 for waiter in self._waiters if not waiter.cancelled),
+                "latency_short": None if self._short_latency is None else round(self._short_latency, 3),
+                "latency_long": None if self._long_latency is None else round(self._long_latency, 3)
+            })
+        return stats
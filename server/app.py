@@ -1,7 +1,7 @@
 
 # app.py - Main Flask application file
 
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context
 import os
 import json
 import random
@@ -30,7 +30,10 @@ from transformers import pipeline
 from textblob import TextBlob
 import re
 import pickle
-from divide import TweetMetricsAnalyzer,EnhancedViralThreadGenerator, TwitterStyleAnalyzer
+from divide import TweetMetricsAnalyzer,EnhancedViralThreadGenerator, TwitterStyleAnalyzer, get_sentiment_batcher_stats, llm_cache, image_cache, key_pool, llm_limiter, image_limiter, hedge_policy, LLM_HEDGING
+from model_registry import model_registry
+from image_store import get_image_store, etag_matches, image_headers, externalize_images
+from image_variants import get_variant_service
 from flask_cors import CORS
 # Configure logging
 logging.basicConfig(
@@ -79,9 +82,8 @@ COMPOSIO_API_KEY = os.environ.get("COMPOSIO_API_KEY", "YOUR_COMPOSIO_API_KEY")
 SERP_API_KEY = os.environ.get("SERP_API_KEY", "YOUR_SERP_API_KEY")
 EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD", "YOUR_EMAIL_PASSWORD")
 
-# Function to get a random API key
-def get_random_gemini_key():
-    return random.choice(GEMINI_API_KEYS)
+# Upper bound on tweets accepted by a single /analyze_batch request
+MAX_ANALYZE_BATCH = int(os.environ.get("MAX_ANALYZE_BATCH", 256))
 
 # Port original TweetMetricsAnalyzer class
 
@@ -245,6 +247,11 @@ def generate_thread():
         
         if not topic:
             return jsonify({'error': 'Topic is required'}), 400
+
+        stream = data.get('stream') or request.args.get('stream')
+        if stream:
+            use_sse = stream == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+            return stream_thread(topic, thread_count, email, use_sse)
             
         # Generate thread
         generator = EnhancedViralThreadGenerator()
@@ -260,6 +267,34 @@ def generate_thread():
         logger.error(f"Error in generate_thread route: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def stream_thread(topic, thread_count, email, use_sse):
+    """Stream generation events as Server-Sent Events or newline-delimited JSON"""
+    generator = EnhancedViralThreadGenerator()
+    events = generator.generate_thread_events(topic, thread_count, email)
+
+    def encode(event):
+        payload = json.dumps(event, default=str)
+        if use_sse:
+            return f"event: {event['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    def body():
+        # Closing this generator (client disconnect) closes events right away,
+        # which cancels the remaining stages without waiting for garbage collection
+        try:
+            for event in events:
+                if event['type'] == 'done' and email:
+                    threading.Thread(target=send_thread_email, args=(email, event['thread'])).start()
+                yield encode(event)
+        finally:
+            events.close()
+
+    return Response(
+        stream_with_context(body()),
+        mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/analyze', methods=['POST'])
 def analyze_tweet():
     try:
@@ -284,6 +319,35 @@ def analyze_tweet():
         logger.error(f"Error in analyze_tweet route: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/analyze_batch', methods=['POST'])
+def analyze_tweet_batch():
+    try:
+        data = request.json
+        tweets = data.get('tweets')
+        
+        if not tweets or not isinstance(tweets, list):
+            return jsonify({'error': 'A list of tweets is required'}), 400
+        if len(tweets) > MAX_ANALYZE_BATCH:
+            return jsonify({'error': f'At most {MAX_ANALYZE_BATCH} tweets per request'}), 400
+        if not all(isinstance(tweet, str) and tweet for tweet in tweets):
+            return jsonify({'error': 'Every tweet must be a non-empty string'}), 400
+            
+        analyzer = TweetMetricsAnalyzer()
+        style_analyzer = TwitterStyleAnalyzer()
+        
+        metrics = analyzer.analyze_batch(tweets)
+        
+        return jsonify({
+            'results': [
+                {'metrics': tweet_metrics, 'style': style_analyzer.analyze_style(tweet)}
+                for tweet, tweet_metrics in zip(tweets, metrics)
+            ]
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in analyze_tweet_batch route: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/export_pdf', methods=['POST'])
 def export_pdf():
     try:
@@ -398,9 +462,9 @@ def save_thread():
         # Generate a unique ID for this thread
         thread_id = f"{int(time.time())}_{random.randint(1000, 9999)}"
         
-        # Save thread data to file
+        # Save thread data to file, with images as image store references rather than bytes
         with open(f"saved_threads/{thread_id}.pkl", 'wb') as f:
-            pickle.dump(thread_data, f)
+            pickle.dump(externalize_images(thread_data), f)
         
         return jsonify({
             'success': True,
@@ -418,12 +482,84 @@ def load_thread(thread_id):
         with open(f"saved_threads/{thread_id}.pkl", 'rb') as f:
             thread_data = pickle.load(f)
         
-        return jsonify(thread_data)
+        # Threads saved before the image store still embed base64 images
+        return jsonify(externalize_images(thread_data))
         
     except Exception as e:
         logger.error(f"Error in load_thread route: {str(e)}")
         return jsonify({'error': 'Thread not found'}), 404
 
+@app.route('/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """Serve a generated image by content hash; the hash is its ETag.
+
+    ``?w=<width>`` serves a resized rendition instead, as ``fmt`` (webp or
+    avif) or the best format the client's Accept header allows.
+    """
+    located = get_image_store().locate(image_id)
+    if located is None:
+        return jsonify({'error': 'Image not found'}), 404
+
+    width = request.args.get('w', type=int)
+    tag, vary = image_id, None
+    if width:
+        variants = get_variant_service()
+        fmt = request.args.get('fmt')
+        if not fmt:
+            fmt, vary = variants.negotiate(request.headers.get('Accept')), 'Accept'
+        tag = f"{image_id}.w{width}.{fmt}"
+
+    headers = image_headers(tag)
+    if vary:
+        headers['Vary'] = vary
+    if etag_matches(tag, request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+
+    if width:
+        try:
+            located = variants.get(image_id, width, fmt)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error rendering image variant: {str(e)}")
+            return jsonify({'error': 'Unable to render image'}), 500
+        if located is None:
+            return jsonify({'error': 'Image not found'}), 404
+
+    path, mime_type = located
+    response = send_file(path, mimetype=mime_type)
+    response.headers.update(headers)
+    return response
+
+@app.route('/model_stats', methods=['GET'])
+def model_stats():
+    try:
+        stats = model_registry.get_stats()
+        stats['sentiment_batcher'] = get_sentiment_batcher_stats()
+        return jsonify(stats)
+    except Exception as e:
+        logger.error(f"Error in model_stats route: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/llm_stats', methods=['GET'])
+def llm_stats():
+    try:
+        return jsonify({
+            'cache': llm_cache.get_stats() if llm_cache is not None else None,
+            'key_pool': key_pool.get_stats(),
+            'concurrency': {
+                'llm': llm_limiter.get_stats(),
+                'image': image_limiter.get_stats()
+            },
+            'hedging': hedge_policy.get_stats() if LLM_HEDGING else None,
+            'images': get_image_store().get_stats(),
+            'image_variants': get_variant_service().get_stats(),
+            'image_cache': image_cache.get_stats() if image_cache else None
+        })
+    except Exception as e:
+        logger.error(f"Error in llm_stats route: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(e):
@@ -437,5 +573,8 @@ def server_error(e):
 if __name__ == '__main__':
     # Create saved_threads directory if it doesn't exist
     os.makedirs('saved_threads', exist_ok=True)
+    # Load the sentiment model up front so the first /analyze isn't slow
+    if os.environ.get('WARM_UP_MODELS', '1') == '1':
+        model_registry.warm_up()
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5009)))
 
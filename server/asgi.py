@@ -0,0 +1,94 @@
+# asgi.py - Async (ASGI) entry point for thread generation
+#
+# Serves /generate from a single event loop so long Gemini round trips don't
+# each hold an OS thread. Run with:
+#     hypercorn asgi:app --bind 0.0.0.0:5010
+
+import asyncio
+import logging
+import os
+
+from quart import Quart, request, jsonify, Response
+from quart_cors import cors
+
+from divide import EnhancedViralThreadGenerator
+from app import send_thread_email
+from image_store import get_image_store, etag_matches, image_headers
+from image_variants import get_variant_service
+
+logger = logging.getLogger(__name__)
+
+app = cors(Quart(__name__))
+
+
+@app.route('/generate', methods=['POST'])
+async def generate_thread():
+    try:
+        data = await request.get_json()
+        topic = data.get('topic')
+        thread_count = int(data.get('thread_count', 5))
+        email = data.get('email', None)
+
+        if not topic:
+            return jsonify({'error': 'Topic is required'}), 400
+
+        # Generate thread
+        generator = EnhancedViralThreadGenerator()
+        thread_data = await generator.agenerate_thread(topic, thread_count, email)
+
+        # Send email if provided (smtplib is blocking, so keep it off the loop)
+        if email:
+            asyncio.get_running_loop().run_in_executor(None, send_thread_email, email, thread_data)
+
+        return jsonify(thread_data)
+
+    except Exception as e:
+        logger.error(f"Error in async generate_thread route: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/images/<image_id>', methods=['GET'])
+async def get_image(image_id):
+    """Serve a generated image by content hash; ``?w=`` and ``fmt`` as in app.py"""
+    if get_image_store().locate(image_id) is None:
+        return jsonify({'error': 'Image not found'}), 404
+
+    width = request.args.get('w', type=int)
+    tag, vary = image_id, None
+    if width:
+        variants = get_variant_service()
+        fmt = request.args.get('fmt')
+        if not fmt:
+            fmt, vary = variants.negotiate(request.headers.get('Accept')), 'Accept'
+        tag = f"{image_id}.w{width}.{fmt}"
+
+    headers = image_headers(tag)
+    if vary:
+        headers['Vary'] = vary
+    if etag_matches(tag, request.headers.get('If-None-Match')):
+        return Response(b'', status=304, headers=headers)
+
+    if width:
+        try:
+            # Rendering waits on the process pool, so keep it off the event loop
+            located = await asyncio.to_thread(variants.get, image_id, width, fmt)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error rendering image variant: {str(e)}")
+            return jsonify({'error': 'Unable to render image'}), 500
+        if located is None:
+            return jsonify({'error': 'Image not found'}), 404
+        path, mime_type = located
+        with open(path, 'rb') as f:
+            data = f.read()
+    else:
+        stored = await asyncio.to_thread(get_image_store().read, image_id)
+        if stored is None:
+            return jsonify({'error': 'Image not found'}), 404
+        data, mime_type = stored
+    return Response(data, mimetype=mime_type, headers=headers)
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.environ.get('ASGI_PORT', 5010)))
@@ -0,0 +1,55 @@
+# bench_emoji.py - Micro-benchmark for emoji counting on tweet-like text
+#
+# Run with: python bench_emoji.py
+
+import re
+import timeit
+
+from emoji_counter import count_emojis
+
+SAMPLE_TWEETS = [
+    "POV: you finally understood the assignment and it's giving main character energy 💅✨",
+    "NOT THE discourse™ continuing into 2025 😭😭😭 bestie we are so back",
+    "Hot take: remote work is here to stay and y'all need to accept it. Thoughts?",
+    "Tea time besties... ☕️ the way that this thread aged 👀🔥",
+    "family reunion be like 👨‍👩‍👧‍👦 vs me in the corner 🧍🏽‍♀️ ngl lowkey iconic",
+    "shipping from 🇺🇸 to 🇯🇵 took 3 weeks, rate it 1️⃣0️⃣ for vibes only",
+    "Just a plain ASCII tweet with no emoji at all, debate me",
+    "Prepare for a reality check... ⚡ unpopular opinion but tabs > spaces",
+]
+
+
+def legacy_count_emojis(text):
+    """The previous implementation, recompiling its pattern on every call"""
+    emoji_pattern = re.compile("["
+        u"\U0001F600-\U0001F64F"  # emoticons
+        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+        u"\U0001F680-\U0001F6FF"  # transport & map symbols
+        u"\U0001F1E0-\U0001F1FF"  # flags
+        u"\U00002702-\U000027B0"
+        u"\U000024C2-\U0001F251"
+        "]+", flags=re.UNICODE)
+    return len(emoji_pattern.findall(text))
+
+
+def bench(func, tweets, number=20000):
+    seconds = timeit.timeit(lambda: [func(tweet) for tweet in tweets], number=number)
+    return seconds / (number * len(tweets)) * 1e6
+
+
+if __name__ == "__main__":
+    print(f"{'tweet':<60} {'legacy':>7} {'new':>5}")
+    for tweet in SAMPLE_TWEETS:
+        print(f"{tweet[:58]:<60} {legacy_count_emojis(tweet):>7} {count_emojis(tweet):>5}")
+
+    groups = {
+        "all tweets": SAMPLE_TWEETS,
+        "with emoji": [tweet for tweet in SAMPLE_TWEETS if not tweet.isascii()],
+        "ascii only": [tweet for tweet in SAMPLE_TWEETS if tweet.isascii()],
+    }
+    print()
+    print(f"{'sample':<12} {'legacy us':>10} {'new us':>8} {'speedup':>8}")
+    for name, tweets in groups.items():
+        legacy_us = bench(legacy_count_emojis, tweets)
+        new_us = bench(count_emojis, tweets)
+        print(f"{name:<12} {legacy_us:>10.2f} {new_us:>8.2f} {legacy_us / new_us:>7.1f}x")
@@ -6,10 +6,10 @@ import json
 import random
 import logging
 from datetime import datetime, timedelta
-import requests
 import io
 import base64
 import time
+from google import genai
 from google.genai import types
 from composio_gemini import Action, ComposioToolSet, App  
 from email.mime.multipart import MIMEMultipart
@@ -21,9 +21,11 @@ from PIL import Image
 from io import BytesIO
 import random
 import concurrent.futures
+import queue
+import asyncio
+import weakref
 # from serpapi import GoogleSearch
 from fpdf import FPDF
-import google.generativeai as genai
 from langchain_google_genai import GoogleGenerativeAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
@@ -31,6 +33,22 @@ from transformers import pipeline
 from textblob import TextBlob
 import re
 import pickle
+import numpy as np
+from model_registry import model_registry
+from emoji_counter import count_emojis
+from llm_cache import CachedChain, create_default_cache
+from task_graph import TaskGraph
+from key_pool import create_key_pool, PerKeyCache
+from http_client import get_session, gemini_http_options
+from adaptive_limiter import AdaptiveLimiter
+from hedging import HedgePolicy, HedgedChain
+from structured_output import StructuredOutputError, is_string_list, parse_string_list, salvage_lines
+from image_store import IMAGE_PASSTHROUGH, get_image_store, image_url
+from image_cache import create_image_cache
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -78,40 +96,405 @@ COMPOSIO_API_KEY = os.environ.get("COMPOSIO_API_KEY", "YOUR_COMPOSIO_API_KEY")
 SERP_API_KEY = os.environ.get("SERP_API_KEY", "YOUR_SERP_API_KEY")
 EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD", "YOUR_EMAIL_PASSWORD")
 
-# Function to get a random API key
-def get_random_gemini_key():
-    return random.choice(GEMINI_API_KEYS)
+# Number of texts per forward pass when scoring sentiment in bulk
+SENTIMENT_BATCH_SIZE = int(os.environ.get("SENTIMENT_BATCH_SIZE", 16))
+
+# Dynamic batching window for concurrent sentiment requests
+SENTIMENT_MAX_BATCH = int(os.environ.get("SENTIMENT_MAX_BATCH", 64))
+SENTIMENT_MAX_WAIT_MS = float(os.environ.get("SENTIMENT_MAX_WAIT_MS", 5))
+SENTIMENT_QUEUE_SIZE = int(os.environ.get("SENTIMENT_QUEUE_SIZE", 1024))
+
+# Seconds a request waits on the batcher before scoring the rest of its texts inline
+SENTIMENT_RESULT_TIMEOUT = float(os.environ.get("SENTIMENT_RESULT_TIMEOUT", 30))
+
+# Gemini text model used by every LangChain chain
+LLM_MODEL = "gemini-1.5-pro"
+LLM_TEMPERATURE = 0.7
+
+# Per-key Gemini budgets and the base cooldown after a 429/503 (doubles on repeats)
+GEMINI_RPM_LIMIT = int(os.environ.get("GEMINI_RPM_LIMIT", 15))
+GEMINI_TPM_LIMIT = int(os.environ.get("GEMINI_TPM_LIMIT", 0)) or None
+KEY_COOLDOWN_SECONDS = int(os.environ.get("KEY_COOLDOWN_SECONDS", 60))
+
+# Usage and cooldowns are shared with other worker processes through KEY_POOL_PATH
+key_pool = create_key_pool(
+    GEMINI_API_KEYS,
+    rpm_limit=GEMINI_RPM_LIMIT,
+    tpm_limit=GEMINI_TPM_LIMIT,
+    cooldown_seconds=KEY_COOLDOWN_SECONDS
+)
+
+# Seconds to cache each chain's responses; chains missing here are never cached.
+# Prompts embed today's date, so repeat topics hit the cache for the rest of the day.
+CHAIN_CACHE_TTLS = {
+    "hook": 24 * 3600,
+    "thread": 24 * 3600,
+    "finale": 24 * 3600,
+    "enhance": 24 * 3600,
+    "image_prompt": 24 * 3600,
+    "image_prompts": 24 * 3600,
+    "action_plan": 24 * 3600
+}
+
+llm_cache = create_default_cache()
+
+# Prompt -> stored image, so a prompt drawn before isn't sent to the image model again
+image_cache = create_image_cache(get_image_store())
+
+# Gemini model used for tweet images
+IMAGE_MODEL = "gemini-2.0-flash-exp-image-generation"
+
+# Tweet field carrying each image: a /images/<hash> URL in pass-through mode,
+# otherwise the legacy base64 PNG
+IMAGE_FIELD = "image_url" if IMAGE_PASSTHROUGH else "image"
+
+# Seconds one image request may run before it is given up on; the tweet ships without it
+IMAGE_TIMEOUT = float(os.environ.get("IMAGE_TIMEOUT", 60))
+
+# How often attach_images checks for a client disconnect while images are running
+IMAGE_CANCEL_POLL_SECONDS = 0.5
+
+# Gemini model that drives the Composio calendar tools
+CALENDAR_MODEL = "gemini-2.0-flash"
+
+# Request timeout (seconds) for google.genai calls; image generation can be slow
+GEMINI_HTTP_TIMEOUT = float(os.environ.get("GEMINI_HTTP_TIMEOUT", 120))
+
+# Process-wide caps on in-flight Gemini calls, adapted to latency and 429/503s
+llm_limiter = AdaptiveLimiter(
+    "llm",
+    initial_limit=int(os.environ.get("LLM_CONCURRENCY_INITIAL", 16)),
+    max_limit=int(os.environ.get("LLM_CONCURRENCY_MAX", 64))
+)
+image_limiter = AdaptiveLimiter(
+    "image",
+    initial_limit=int(os.environ.get("IMAGE_CONCURRENCY_INITIAL", 4)),
+    max_limit=int(os.environ.get("IMAGE_CONCURRENCY_MAX", 16))
+)
+
+# Opt-in hedging (LLM_HEDGING=1): chains named here get a backup call on another
+# key once they run past their p95 latency, capped at LLM_HEDGE_MAX_RATIO of calls
+LLM_HEDGING = os.environ.get("LLM_HEDGING") == "1"
+HEDGED_CHAINS = {"hook", "finale", "action_plan"}
+hedge_policy = HedgePolicy(
+    max_ratio=float(os.environ.get("LLM_HEDGE_MAX_RATIO", 0.1)),
+    percentile=float(os.environ.get("LLM_HEDGE_PERCENTILE", 95))
+)
+
+# Rewrites requested in the single optimize_tweet call; the best-scoring one is kept
+OPTIMIZE_CANDIDATES = int(os.environ.get("OPTIMIZE_CANDIDATES", 3))
+
+# Tweets scoring at least this twitter_native_score are left as they are
+OPTIMIZE_SCORE_THRESHOLD = 70
+
+# Ask for every image prompt in a thread with one LLM call instead of one per tweet
+IMAGE_PROMPT_BATCHING = os.environ.get("IMAGE_PROMPT_BATCHING", "1") == "1"
+
+# Tweets each thread_chain call is asked for; extra entries are dropped
+THREAD_TWEETS_PER_PERSPECTIVE = 2
+
+# LLM calls spent turning malformed thread_chain JSON into valid JSON before
+# falling back to cleaning up the raw lines
+JSON_REPAIR_ATTEMPTS = int(os.environ.get("JSON_REPAIR_ATTEMPTS", 1))
+
+# Max in-flight LLM/image calls per event loop for agenerate_thread
+ASYNC_LLM_CONCURRENCY = int(os.environ.get("ASYNC_LLM_CONCURRENCY", 32))
+
+_async_llm_semaphores = weakref.WeakKeyDictionary()
+
+def get_async_llm_semaphore():
+    """Semaphore bounding concurrent LLM calls on the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _async_llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _async_llm_semaphores[loop] = asyncio.Semaphore(ASYNC_LLM_CONCURRENCY)
+    return semaphore
+
+async def await_with_default(awaitable, timeout, default, name):
+    """Await with a timeout, returning default (and logging) on timeout or error"""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Stage {name} timed out, using default")
+    except Exception as e:
+        logger.warning(f"Stage {name} failed: {str(e)}, using default")
+    return default
+
+# Worker threads for the generate_thread stage graph and for per-tweet fan-out inside a stage
+GRAPH_WORKERS = int(os.environ.get("GRAPH_WORKERS", 8))
+FANOUT_WORKERS = int(os.environ.get("FANOUT_WORKERS", 8))
+
+# Per-stage timeouts (seconds) for generate_thread
+STAGE_TIMEOUTS = {
+    "hook": 60,
+    "thread": 60,
+    "finale": 60,
+    "insights": 20,
+    "counterpoints": 90,
+    "processed": 120,
+    "images": 180,
+    "action_plan": 90,
+    "calendar": 120
+}
+
+def image_generation_config(timeout_seconds=IMAGE_TIMEOUT):
+    """GenerateContentConfig for image calls, with a per-request timeout where the SDK supports one"""
+    options = {"response_modalities": ['Text', 'Image']}
+    if "http_options" in getattr(types.GenerateContentConfig, "model_fields", {}):
+        options["http_options"] = types.HttpOptions(timeout=int(timeout_seconds * 1000))
+    return types.GenerateContentConfig(**options)
+
+
+def estimate_tokens(text):
+    """Rough token count for TPM budgeting (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+# Clients are built once per API key and reused by every request. Each one
+# carries its own key, so nothing touches the global genai.configure state,
+# and all of them share the pooled transport from http_client.
+gemini_clients = PerKeyCache(
+    lambda api_key: genai.Client(api_key=api_key, http_options=gemini_http_options(GEMINI_HTTP_TIMEOUT))
+)
+
+def build_gemini_llm(spec):
+    """GoogleGenerativeAI for (model, temperature, api_key, json_mode).
+
+    json_mode asks Gemini for application/json output. Older
+    langchain-google-genai releases don't accept response_mime_type; those
+    get a plain LLM and rely on the prompt and parser alone.
+    """
+    model, temperature, api_key, json_mode = spec
+    if json_mode:
+        try:
+            return GoogleGenerativeAI(model=model, temperature=temperature, google_api_key=api_key,
+                                      response_mime_type="application/json")
+        except (TypeError, ValueError) as e:
+            logger.warning(f"JSON mode unavailable, using prompt-only JSON: {str(e)}")
+    return GoogleGenerativeAI(model=model, temperature=temperature, google_api_key=api_key)
+
+
+gemini_llms = PerKeyCache(build_gemini_llm)
+
+
+class PooledChain:
+    """LLMChain look-alike that leases a key from key_pool for every call.
+
+    Each call runs on the least-loaded key, and its latency or rate-limit
+    error is reported back so later calls steer around unhealthy keys. The
+    LLMChain for each key is built on first use and reused afterwards.
+    """
+
+    def __init__(self, prompt, model=LLM_MODEL, temperature=LLM_TEMPERATURE, json_mode=False):
+        self.prompt = prompt
+        self.model = model
+        self.temperature = temperature
+        self.json_mode = json_mode
+        self._chains = PerKeyCache(
+            lambda api_key: LLMChain(
+                llm=gemini_llms.get((self.model, self.temperature, api_key, self.json_mode)),
+                prompt=self.prompt
+            )
+        )
+
+    def _chain(self, api_key):
+        return self._chains.get(api_key)
+
+    def call(self, inputs, exclude=(), used=None):
+        """Run on a key outside ``exclude``, adding the leased key to ``used``"""
+        estimated_tokens = estimate_tokens(self.prompt.format(**inputs))
+        # Lease first, so waiting for a key neither holds a slot nor counts as call latency
+        with key_pool.lease(exclude, estimated_tokens) as api_key, llm_limiter.slot():
+            if used is not None:
+                used.add(api_key)
+            return self._chain(api_key).run(**inputs)
+
+    def run(self, **kwargs):
+        return self.call(kwargs)
+
+    def stream(self, on_token, **kwargs):
+        """Stream the completion through on_token and return the full text"""
+        prompt = self.prompt.format(**kwargs)
+        chunks = []
+        with key_pool.lease(estimated_tokens=estimate_tokens(prompt)) as api_key, llm_limiter.slot():
+            for chunk in self._chain(api_key).llm.stream(prompt):
+                chunks.append(chunk)
+                on_token(chunk)
+        return "".join(chunks)
+
+    async def acall(self, inputs, exclude=(), used=None):
+        estimated_tokens = estimate_tokens(self.prompt.format(**inputs))
+        async with key_pool.alease(exclude, estimated_tokens) as api_key, llm_limiter.aslot():
+            if used is not None:
+                used.add(api_key)
+            return await self._chain(api_key).arun(**inputs)
+
+    async def arun(self, **kwargs):
+        return await self.acall(kwargs)
+
+
+# One PooledChain per distinct prompt, shared by every generator instance
+pooled_chains = PerKeyCache(
+    lambda spec: PooledChain(PromptTemplate(input_variables=list(spec[0]), template=spec[1]), json_mode=spec[2])
+)
+
+
+def run_sentiment_pipeline(sentiment_analyzer, texts):
+    """Run the sentiment pipeline over texts in padded micro-batches"""
+    # Sort by length so each micro-batch pads to a similar size, then restore order
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    sorted_texts = [texts[i] for i in order]
+    with model_registry.inference_lock("sentiment"):
+        sorted_results = sentiment_analyzer(
+            sorted_texts,
+            batch_size=SENTIMENT_BATCH_SIZE,
+            truncation=True
+        )
+    model_registry.record_call("sentiment", len(texts))
+
+    results = [None] * len(texts)
+    for position, index in enumerate(order):
+        results[index] = sorted_results[position]
+    return results
+
+
+class SentimentBatcher:
+    """Coalesces concurrent sentiment requests into shared batched forward passes.
+
+    Callers get a Future back from ``submit``. A single worker thread drains the
+    bounded queue, waiting at most ``max_wait_ms`` after the first item for more
+    to arrive, and runs up to ``max_batch_size`` texts per pipeline call.
+    """
+
+    def __init__(self, sentiment_analyzer, max_batch_size=SENTIMENT_MAX_BATCH,
+                 max_wait_ms=SENTIMENT_MAX_WAIT_MS, max_queue_size=SENTIMENT_QUEUE_SIZE):
+        self.sentiment_analyzer = sentiment_analyzer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        self._worker = threading.Thread(target=self._run, name="sentiment-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text):
+        """Queue a text for scoring; raises queue.Full if the queue stays saturated"""
+        future = concurrent.futures.Future()
+        self._queue.put((text, future), timeout=self.max_wait * 10)
+        return future
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Skip callers that cancelled while waiting in the queue
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                results = run_sentiment_pipeline(self.sentiment_analyzer, [text for text, _ in batch])
+            except Exception as e:
+                logger.error(f"Error in batched sentiment inference: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._largest_batch = max(self._largest_batch, len(batch))
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "average_batch_size": round(self._items / self._batches, 2) if self._batches else 0,
+                "largest_batch": self._largest_batch,
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000
+            }
+
+
+_sentiment_batcher = None
+_sentiment_batcher_lock = threading.Lock()
+
+def get_sentiment_batcher():
+    """Return the process-wide SentimentBatcher, starting it on first use"""
+    global _sentiment_batcher
+    if _sentiment_batcher is None:
+        with _sentiment_batcher_lock:
+            if _sentiment_batcher is None:
+                _sentiment_batcher = SentimentBatcher(model_registry.get("sentiment"))
+    return _sentiment_batcher
+
+def get_sentiment_batcher_stats():
+    """Batcher stats, or None if no request has started the batcher yet"""
+    return _sentiment_batcher.get_stats() if _sentiment_batcher is not None else None
 
 
 class TweetMetricsAnalyzer:
     def __init__(self):
-        try:
-            self.sentiment_analyzer = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")
-        except Exception as e:
-            logger.error(f"Error loading sentiment model: {str(e)}")
-            self.sentiment_analyzer = None
+        # The pipeline is loaded once per process and shared by every analyzer
+        self.sentiment_analyzer = model_registry.get("sentiment")
 
     def count_emojis(self, text: str) -> int:
-        emoji_pattern = re.compile("["
-            u"\U0001F600-\U0001F64F"  # emoticons
-            u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-            u"\U0001F680-\U0001F6FF"  # transport & map symbols
-            u"\U0001F1E0-\U0001F1FF"  # flags
-            u"\U00002702-\U000027B0"
-            u"\U000024C2-\U0001F251"
-            "]+", flags=re.UNICODE)
-        return len(emoji_pattern.findall(text))
+        return count_emojis(text)
 
-    def analyze(self, text: str) -> dict:
-        if self.sentiment_analyzer:
-            sentiment_result = self.sentiment_analyzer(text)[0]
-            sentiment_label = sentiment_result["label"]
-            confidence = sentiment_result["score"]
-        else:
+    def _sentiment_batch(self, texts: list) -> list:
+        """Score texts through the shared micro-batching queue"""
+        if not self.sentiment_analyzer:
             # Fallback if model fails to load
-            sentiment_label = "UNKNOWN"
-            confidence = 0.5
-            
+            return [{"label": "UNKNOWN", "score": 0.5} for _ in texts]
+
+        batcher = get_sentiment_batcher()
+        futures = []
+        try:
+            for text in texts:
+                futures.append(batcher.submit(text))
+        except queue.Full:
+            # Queue is saturated; keep what was queued and score the rest inline rather than fail it
+            logger.warning("Sentiment queue full, running inference inline")
+
+        results = [None] * len(texts)
+        deadline = time.monotonic() + SENTIMENT_RESULT_TIMEOUT
+        for i, future in enumerate(futures):
+            try:
+                results[i] = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except concurrent.futures.TimeoutError:
+                # Dropped from the batch if the worker hasn't picked it up yet
+                future.cancel()
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) > len(texts) - len(futures):
+            logger.warning(f"Sentiment batcher timed out after {SENTIMENT_RESULT_TIMEOUT}s, running inference inline")
+        if missing:
+            inline = run_sentiment_pipeline(self.sentiment_analyzer, [texts[i] for i in missing])
+            for i, result in zip(missing, inline):
+                results[i] = result
+        return results
+
+    def _text_features(self, text: str) -> dict:
+        """TextBlob, emoji and length features for a single text"""
         try:
             blob = TextBlob(text)
             subjectivity = blob.sentiment.subjectivity
@@ -119,34 +502,151 @@ class TweetMetricsAnalyzer:
         except:
             subjectivity = 0.5
             polarity = 0
-            
+
         return {
-            "sentiment": sentiment_label,
-            "confidence": confidence,
             "subjectivity": subjectivity,
             "polarity": polarity,
             "emoji_count": self.count_emojis(text),
             "character_count": len(text),
             "word_count": len(text.split())
         }
+
+    def analyze_batch(self, texts: list) -> list:
+        """Analyze many texts with one batched sentiment pass"""
+        if not texts:
+            return []
+
+        sentiment_results = self._sentiment_batch(texts)
+
+        metrics = []
+        for text, sentiment_result in zip(texts, sentiment_results):
+            entry = {
+                "sentiment": sentiment_result["label"],
+                "confidence": sentiment_result["score"]
+            }
+            entry.update(self._text_features(text))
+            metrics.append(entry)
+        return metrics
+
+    def analyze(self, text: str) -> dict:
+        return self.analyze_batch([text])[0]
     
 
+class IndicatorMatcher:
+    """Finds every indicator phrase present in a text with a single regex pass.
+
+    The phrases are compiled into one trie-shaped pattern inside a lookahead,
+    so each text position reports the longest phrase starting there. Any
+    shorter phrase is a substring of some longest match, so expanding each
+    match to the phrases it contains recovers exactly the set that
+    ``phrase in text`` would find.
+    """
+
+    def __init__(self, indicators):
+        phrases = sorted({phrase for words in indicators.values() for phrase in words})
+
+        trie = {}
+        for phrase in phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[""] = True
+        self.pattern = re.compile("(?=(" + self._trie_pattern(trie) + "))")
+
+        self.contained = {
+            phrase: [other for other in phrases if other in phrase]
+            for phrase in phrases
+        }
+        # Phrase -> categories it counts towards; repeats within a list count repeatedly
+        self.categories = {phrase: [] for phrase in phrases}
+        for category, words in indicators.items():
+            for phrase in words:
+                self.categories[phrase].append(category)
+        self.category_names = list(indicators)
+
+    @classmethod
+    def _trie_pattern(cls, node):
+        branches = [re.escape(char) + cls._trie_pattern(child) for char, child in node.items() if char != ""]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A phrase can end here, so make the longer continuations optional (greedy)
+        return "(?:" + pattern + ")?" if "" in node else pattern
+
+    def find(self, text):
+        """Set of indicator phrases that occur in text"""
+        found = set()
+        for phrase in set(self.pattern.findall(text)):
+            found.update(self.contained[phrase])
+        return found
+
+    def count(self, text):
+        """Per-category count of indicator phrases that occur in text"""
+        counts = dict.fromkeys(self.category_names, 0)
+        for phrase in self.find(text):
+            for category in self.categories[phrase]:
+                counts[category] += 1
+        return counts
+
+
+# Rate metrics in analyze_style and the indicator category each one is computed from
+STYLE_RATE_METRICS = [
+    ("sass_level", "sass_words"),
+    ("meme_density", "meme_phrases"),
+    ("engagement_potential", "engagement_words"),
+    ("dark_humor_score", "dark_humor"),
+    ("slang_usage", "internet_slang"),
+    ("argument_strength", "argument_starters"),
+    ("contemporary_score", "current_year_slang"),
+    ("perspective_balance", "perspective_markers")
+]
+
+# Style tag -> bit in the style_tags bitmask returned by analyze_style_bulk
+STYLE_TAG_BITS = {
+    "extra_sassy": 1 << 0,
+    "meme_lord": 1 << 1,
+    "edgy": 1 << 2,
+    "engagement_bait": 1 << 3,
+    "extremely_online": 1 << 4,
+    "balanced_take": 1 << 5
+}
+
+# Metric that triggers each style tag when it is above 70
+STYLE_TAG_METRICS = {
+    "extra_sassy": "sass_level",
+    "meme_lord": "meme_density",
+    "edgy": "dark_humor_score",
+    "engagement_bait": "engagement_potential",
+    "extremely_online": "contemporary_score",
+    "balanced_take": "perspective_balance"
+}
+
+def decode_style_tags(mask):
+    """Convert a style_tags bitmask back into the list analyze_style returns"""
+    return [tag for tag, bit in STYLE_TAG_BITS.items() if int(mask) & bit]
+
+
 class TwitterStyleAnalyzer:
+    STYLE_INDICATORS = {
+        "emotional_triggers": ["wild", "insane", "crying", "screaming", "based", "real", "unhinged", "no way", "literally dead"],
+        "engagement_words": ["ratio", "hot take", "thread", "debate me", "fight me", "thoughts?", "disagree?"],
+        "power_words": ["actually", "literally", "objectively", "factually", "historically", "technically"],
+        "meme_phrases": ["ngl", "fr fr", "iykyk", "lowkey", "highkey", "based", "chad", "W", "L", "no cap", "bussin"],
+        "sass_words": ["bestie", "literally", "imagine", "apparently", "supposedly", "girlie", "bestie"],
+        "dark_humor": ["oof", "rip", "dead", "crying", "screaming", "help"],
+        "internet_slang": ["tbh", "imo", "idk", "nvm", "dm", "rt", "fyi", "aka"],
+        "viral_formats": ["POV:", "NOT THE", "it's giving", "the way that", "y'all"],
+        "argument_starters": ["respectfully", "with peace and love", "no offense but", "hot take"],
+        "current_year_slang": ["slay", "periodt", "ate", "understood the assignment", "main character"],
+        "transitions": ["meanwhile", "however", "but wait", "plot twist", "on the flip side", "here's the tea"],
+        "perspective_markers": ["unpopular opinion", "hot take", "controversial but", "hear me out", "plot twist"]
+    }
+
+    # Compiled once when the class is loaded and shared by every instance
+    INDICATOR_MATCHER = IndicatorMatcher(STYLE_INDICATORS)
+
     def __init__(self):
-        self.style_indicators = {
-            "emotional_triggers": ["wild", "insane", "crying", "screaming", "based", "real", "unhinged", "no way", "literally dead"],
-            "engagement_words": ["ratio", "hot take", "thread", "debate me", "fight me", "thoughts?", "disagree?"],
-            "power_words": ["actually", "literally", "objectively", "factually", "historically", "technically"],
-            "meme_phrases": ["ngl", "fr fr", "iykyk", "lowkey", "highkey", "based", "chad", "W", "L", "no cap", "bussin"],
-            "sass_words": ["bestie", "literally", "imagine", "apparently", "supposedly", "girlie", "bestie"],
-            "dark_humor": ["oof", "rip", "dead", "crying", "screaming", "help"],
-            "internet_slang": ["tbh", "imo", "idk", "nvm", "dm", "rt", "fyi", "aka"],
-            "viral_formats": ["POV:", "NOT THE", "it's giving", "the way that", "y'all"],
-            "argument_starters": ["respectfully", "with peace and love", "no offense but", "hot take"],
-            "current_year_slang": ["slay", "periodt", "ate", "understood the assignment", "main character"],
-            "transitions": ["meanwhile", "however", "but wait", "plot twist", "on the flip side", "here's the tea"],
-            "perspective_markers": ["unpopular opinion", "hot take", "controversial but", "hear me out", "plot twist"]
-        }
+        self.style_indicators = self.STYLE_INDICATORS
 
         self.time_periods = {
             "morning": (5, 11),
@@ -177,16 +677,17 @@ class TwitterStyleAnalyzer:
 
         text_lower = text.lower()
 
-        # Calculate comprehensive style metrics
-        sass_count = sum(word in text_lower for word in self.style_indicators["sass_words"])
-        meme_count = sum(phrase in text_lower for phrase in self.style_indicators["meme_phrases"])
-        engagement_count = sum(word in text_lower for word in self.style_indicators["engagement_words"])
-        dark_humor_count = sum(word in text_lower for word in self.style_indicators["dark_humor"])
-        slang_count = sum(word in text_lower for word in self.style_indicators["internet_slang"])
-        argument_count = sum(phrase in text_lower for phrase in self.style_indicators["argument_starters"])
-        viral_format_count = sum(format in text_lower for format in self.style_indicators["viral_formats"])
-        contemporary_count = sum(slang in text_lower for slang in self.style_indicators["current_year_slang"])
-        perspective_count = sum(marker in text_lower for marker in self.style_indicators["perspective_markers"])
+        # Calculate comprehensive style metrics in one pass over the text
+        counts = self.INDICATOR_MATCHER.count(text_lower)
+        sass_count = counts["sass_words"]
+        meme_count = counts["meme_phrases"]
+        engagement_count = counts["engagement_words"]
+        dark_humor_count = counts["dark_humor"]
+        slang_count = counts["internet_slang"]
+        argument_count = counts["argument_starters"]
+        viral_format_count = counts["viral_formats"]
+        contemporary_count = counts["current_year_slang"]
+        perspective_count = counts["perspective_markers"]
 
         # Calculate normalized scores (0-100)
         word_count = len(text_lower.split())
@@ -226,32 +727,70 @@ class TwitterStyleAnalyzer:
         if metrics["perspective_balance"] > 70: metrics["style_tags"].append("balanced_take")
 
         return metrics
+
+    def analyze_style_bulk(self, texts, as_frame=True):
+        """Score many texts at once, one column per analyze_style metric.
+
+        Accepts a list or pandas Series of strings. Returns a DataFrame (indexed
+        like the Series, if one was given) when pandas is available and
+        ``as_frame`` is set, otherwise a dict of NumPy arrays. style_tags comes
+        back as an integer bitmask; see STYLE_TAG_BITS and decode_style_tags.
+        """
+        index = None
+        if pd is not None and isinstance(texts, pd.Series):
+            index = texts.index
+            texts = texts.fillna("").astype(str).tolist()
+
+        matcher = self.INDICATOR_MATCHER
+        categories = [category for _, category in STYLE_RATE_METRICS] + ["viral_formats"]
+        column = {category: i for i, category in enumerate(categories)}
+
+        # The only per-text Python work: one regex pass and a word count
+        counts = np.zeros((len(texts), len(categories)), dtype=np.int64)
+        word_counts = np.zeros(len(texts), dtype=np.int64)
+        for row, text in enumerate(texts):
+            text_lower = text.lower()
+            word_counts[row] = len(text_lower.split())
+            for phrase in matcher.find(text_lower):
+                for category in matcher.categories[phrase]:
+                    if category in column:
+                        counts[row, column[category]] += 1
+
+        # Same normalization and clamping as analyze_style, vectorized over rows
+        rates = np.minimum(counts[:, :-1] / np.maximum(word_counts, 1)[:, None] * 200, 100)
+        metrics = {name: rates[:, i] for i, (name, _) in enumerate(STYLE_RATE_METRICS)}
+        metrics["viral_format_count"] = counts[:, column["viral_formats"]]
+
+        metrics["clout_factor"] = np.minimum(
+            (metrics["sass_level"] + metrics["meme_density"] + metrics["engagement_potential"]) / 3,
+            100
+        )
+        metrics["twitter_native_score"] = np.minimum(
+            (metrics["slang_usage"] + metrics["contemporary_score"] + metrics["viral_format_count"] * 20) / 3,
+            100
+        )
+        metrics["ratio_potential"] = np.minimum(
+            (metrics["argument_strength"] + metrics["dark_humor_score"] + metrics["sass_level"]) / 3,
+            100
+        )
+
+        style_tags = np.zeros(len(texts), dtype=np.int64)
+        for tag, metric in STYLE_TAG_METRICS.items():
+            style_tags |= np.where(metrics[metric] > 70, STYLE_TAG_BITS[tag], 0)
+        metrics["style_tags"] = style_tags
+
+        if as_frame and pd is not None:
+            return pd.DataFrame(metrics, index=index)
+        return metrics
     
 class EnhancedViralThreadGenerator:
     def __init__(self):
         self.tweet_metrics = TweetMetricsAnalyzer()
         self.style_analyzer = TwitterStyleAnalyzer()
         self.setup_prompts()
-        self.api_key_index = 0
-        
-    def get_next_api_key(self):
-        """Get the next API key using round-robin"""
-        key = GEMINI_API_KEYS[self.api_key_index]
-        self.api_key_index = (self.api_key_index + 1) % len(GEMINI_API_KEYS)
-        return key
-        
-    def get_llm(self):
-        """Get a Gemini LLM instance with a fresh API key"""
-        api_key = self.get_next_api_key()
-        try:
-            genai.configure(api_key=api_key)
-            return GoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key)
-        except Exception as e:
-            logger.error(f"Error initializing LLM with key {api_key}: {str(e)}")
-            # Try with another key if this one fails
-            api_key = self.get_next_api_key()
-            genai.configure(api_key=api_key)
-            return GoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key)
+        # Original tweet -> optimized text, so no tweet is rewritten twice in a thread
+        self._optimized = {}
+        self._optimized_lock = threading.Lock()
 
     def setup_prompts(self):
         self.hook_template = PromptTemplate(
@@ -287,7 +826,23 @@ class EnhancedViralThreadGenerator:
 
             Maintain the {perspective} perspective while acknowledging potential counterpoints.
             Make it feel authentic and viral-worthy.
-            Format as a list of 2 tweets, separated by newlines.
+
+            Respond with JSON only, in this exact shape, with exactly 2 tweets:
+            {{"tweets": ["first tweet", "second tweet"]}}
+            """
+        )
+
+        self.json_list_repair_template = PromptTemplate(
+            input_variables=["text", "key"],
+            template="""
+            The text below was meant to be a JSON object with a "{key}" list of strings.
+            Extract the items exactly as written, dropping numbering, labels and blank lines.
+
+            Text:
+            {text}
+
+            Respond with JSON only, in this exact shape:
+            {{"{key}": ["first item", "second item"]}}
             """
         )
 
@@ -338,78 +893,290 @@ class EnhancedViralThreadGenerator:
             """
         )
 
-    def create_chain(self, prompt_template):
-        """Create a chain with a fresh LLM instance"""
-        return LLMChain(llm=self.get_llm(), prompt=prompt_template)
+        self.image_prompts_template = PromptTemplate(
+            input_variables=["tweets", "count"],
+            template="""
+            Create an engaging and highly shareable social media image prompt for each of these {count} tweets:
+            {tweets}
 
-    def optimize_tweet(self, tweet):
-        """Optimize a tweet for virality"""
-        style_metrics = self.style_analyzer.analyze_style(tweet)
+            Make each image description:
+            1. Visually striking and attention-grabbing
+            2. Capture the essence of its tweet's message
+            3. Include relevant elements that would make it viral-worthy
+            4. Work well as a Twitter/X image
+            5. Be provocative but not offensive
 
-        if style_metrics["twitter_native_score"] < 70:
+            Respond with JSON only: exactly {count} detailed image prompts, in the same order as the tweets.
+            {{"prompts": ["image prompt for tweet 1", "image prompt for tweet 2"]}}
+            """
+        )
+
+        self.enhance_template = PromptTemplate(
+            input_variables=["tweet", "candidates"],
+            template="""
+            Rewrite this tweet {candidates} different ways.
+            Make each one absolutely unhinged (in a good way).
+            Max out the sass, add current memes, and make it extremely online.
+            Keep the core message but make it Twitter native af.
+            Each rewrite under 280 characters.
+
+            Tweet: {tweet}
+
+            Respond with JSON only, in this exact shape:
+            {{"candidates": ["first rewrite", "second rewrite"]}}
+            """
+        )
+
+        self.action_plan_template = PromptTemplate(
+            input_variables=["topic", "tweets", "schedule", "current_date"],
+            template="""
+            Create a comprehensive Action Plan for a viral Twitter thread campaign about "{topic}".
+            
+            Thread Content:
+            {tweets}
+            
+            Posting Schedule:
+            {schedule}
+            
+            Today's date: {current_date}
+            
+            Include in your action plan:
+            1. A catchy campaign name
+            2. Strategic objective (what this campaign aims to achieve)
+            3. Target audience analysis
+            4. Engagement tactics for each tweet
+            5. Recommendations for:
+               - Hashtags to use
+               - Accounts to tag
+               - Follow-up content ideas
+            6. Metrics to track for success
+            7. Potential contingency plans for negative engagement
+            
+            Format this as a professional action plan that could be presented to a client.
+            """
+        )
+
+    def create_chain(self, prompt_template, cache_name=None, json_mode=False, json_key=None, json_count=None):
+        """Shared chain that draws a pooled key per call; cache_name opts into caching and hedging.
+
+        With json_key set, only completions holding a JSON list under that key
+        (of exactly json_count items, if given) are cached.
+        """
+        chain = pooled_chains.get((tuple(prompt_template.input_variables), prompt_template.template, json_mode))
+        if LLM_HEDGING and cache_name in HEDGED_CHAINS:
+            chain = HedgedChain(chain, hedge_policy, cache_name)
+        ttl = CHAIN_CACHE_TTLS.get(cache_name)
+        if ttl and llm_cache is not None:
+            validate = (lambda completion: is_string_list(completion, json_key, json_count)) if json_key else None
+            return CachedChain(chain, llm_cache, ttl, LLM_MODEL, LLM_TEMPERATURE, validate=validate)
+        return chain
+
+    def _parse_list(self, completion, key, max_items):
+        """Strings in a {key: [...]} completion, or None if it doesn't parse"""
+        try:
+            return parse_string_list(completion, key, max_items=max_items)
+        except StructuredOutputError as e:
+            logger.warning(f"Malformed {key} JSON: {str(e)}")
+            return None
+
+    def parse_json_list(self, completion, key, max_items=None):
+        """Parse a {key: [...]} completion, with at most JSON_REPAIR_ATTEMPTS repair calls.
+
+        If repair fails too, the raw lines are cleaned up locally so numbering
+        and blank lines never turn into extra items to process.
+        """
+        items = self._parse_list(completion, key, max_items)
+        if items is not None:
+            return items
+
+        repair_chain = self.create_chain(self.json_list_repair_template, json_mode=True)
+        for _ in range(JSON_REPAIR_ATTEMPTS):
             try:
-                enhance_prompt = PromptTemplate(
-                    input_variables=["tweet"],
-                    template="""
-                    Make this tweet absolutely unhinged (in a good way).
-                    Max out the sass, add current memes, and make it extremely online.
-                    Keep the core message but make it Twitter native af:
-                    {tweet}
-                    """
-                )
+                items = self._parse_list(repair_chain.run(text=completion, key=key), key, max_items)
+            except Exception as e:
+                logger.warning(f"Error repairing {key} JSON: {str(e)}")
+            if items is not None:
+                return items
+        return salvage_lines(completion, max_items=max_items)
 
-                enhance_chain = self.create_chain(enhance_prompt)
-                enhanced_tweet = enhance_chain.run(tweet=tweet)
+    async def aparse_json_list(self, completion, key, max_items=None):
+        """Async parse_json_list"""
+        items = self._parse_list(completion, key, max_items)
+        if items is not None:
+            return items
 
-                new_style_metrics = self.style_analyzer.analyze_style(enhanced_tweet)
-                if new_style_metrics["twitter_native_score"] > style_metrics["twitter_native_score"]:
-                    return enhanced_tweet
+        repair_chain = self.create_chain(self.json_list_repair_template, json_mode=True)
+        for _ in range(JSON_REPAIR_ATTEMPTS):
+            try:
+                items = self._parse_list(await self._arun(repair_chain, text=completion, key=key), key, max_items)
             except Exception as e:
-                logger.warning(f"Error optimizing tweet: {str(e)}")
-                
-        return tweet
+                logger.warning(f"Error repairing {key} JSON: {str(e)}")
+            if items is not None:
+                return items
+        return salvage_lines(completion, max_items=max_items)
+
+    def parse_thread_tweets(self, completion):
+        """Tweets in thread_chain output; see parse_json_list"""
+        return self.parse_json_list(completion, "tweets", max_items=THREAD_TWEETS_PER_PERSPECTIVE)
+
+    async def aparse_thread_tweets(self, completion):
+        """Async parse_thread_tweets"""
+        return await self.aparse_json_list(completion, "tweets", max_items=THREAD_TWEETS_PER_PERSPECTIVE)
+
+    def _already_optimized(self, tweet):
+        """Optimized text for tweet if this thread has seen it (as input or output), else None"""
+        with self._optimized_lock:
+            return self._optimized.get(tweet)
+
+    def _remember_optimized(self, tweet, optimized):
+        with self._optimized_lock:
+            self._optimized[tweet] = optimized
+            # Feeding an optimized tweet back in must not rewrite it again
+            self._optimized[optimized] = optimized
+        return optimized
+
+    def _best_candidate(self, tweet, baseline_score, candidates):
+        """Highest-scoring rewrite among candidates, or tweet if none beats baseline_score"""
+        if not candidates:
+            return tweet
+
+        scores = self.style_analyzer.analyze_style_bulk(candidates, as_frame=False)["twitter_native_score"]
+        best = int(np.argmax(scores))
+        return candidates[best] if scores[best] > baseline_score else tweet
+
+    def optimize_tweet(self, tweet):
+        """Optimize a tweet for virality, at most once per tweet per thread.
+
+        One LLM call returns OPTIMIZE_CANDIDATES rewrites; all of them are scored
+        with TwitterStyleAnalyzer and the best is kept if it beats the original.
+        """
+        optimized = self._already_optimized(tweet)
+        if optimized is not None:
+            return optimized
+
+        style_metrics = self.style_analyzer.analyze_style(tweet)
+        if style_metrics["twitter_native_score"] >= OPTIMIZE_SCORE_THRESHOLD:
+            return self._remember_optimized(tweet, tweet)
+
+        try:
+            enhance_chain = self.create_chain(
+                self.enhance_template, cache_name="enhance", json_mode=True, json_key="candidates"
+            )
+            completion = enhance_chain.run(tweet=tweet, candidates=OPTIMIZE_CANDIDATES)
+            candidates = self.parse_json_list(completion, "candidates", max_items=OPTIMIZE_CANDIDATES)
+            return self._remember_optimized(
+                tweet, self._best_candidate(tweet, style_metrics["twitter_native_score"], candidates)
+            )
+        except Exception as e:
+            logger.warning(f"Error optimizing tweet: {str(e)}")
+            return tweet
 
     def generate_image_prompt(self, tweet_content):
         """Generate an image prompt based on tweet content"""
         try:
-            image_prompt_chain = self.create_chain(self.image_prompt_template)
+            image_prompt_chain = self.create_chain(self.image_prompt_template, cache_name="image_prompt")
             image_prompt = image_prompt_chain.run(tweet_content=tweet_content)
             return image_prompt.strip()
         except Exception as e:
             logger.error(f"Error generating image prompt: {str(e)}")
             return f"Social media image about {tweet_content[:50]}..."
 
+    def _parse_image_prompts(self, completion, count):
+        """The prompts in a batched image-prompt completion; raises unless there is one per tweet"""
+        prompts = parse_string_list(completion, "prompts")
+        if len(prompts) != count:
+            raise StructuredOutputError(f"Expected {count} image prompts, got {len(prompts)}")
+        return prompts
+
+    def _image_prompts_inputs(self, tweets):
+        numbered = "\n".join(f"Tweet {i}: {tweet}" for i, tweet in enumerate(tweets, 1))
+        return {"tweets": numbered, "count": len(tweets)}
+
+    def generate_image_prompts(self, tweets):
+        """Image prompts for all of a thread's tweets, in one LLM call when batching is on.
+
+        Falls back to a generate_image_prompt call per tweet if the batch call
+        fails or doesn't return exactly one prompt per tweet.
+        """
+        if IMAGE_PROMPT_BATCHING and len(tweets) > 1:
+            try:
+                chain = self.create_chain(
+                    self.image_prompts_template, cache_name="image_prompts", json_mode=True,
+                    json_key="prompts", json_count=len(tweets)
+                )
+                return self._parse_image_prompts(chain.run(**self._image_prompts_inputs(tweets)), len(tweets))
+            except Exception as e:
+                logger.warning(f"Batched image prompts failed, falling back to one call per tweet: {str(e)}")
+
+        if len(tweets) <= 1:
+            return [self.generate_image_prompt(tweet) for tweet in tweets]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(tweets), FANOUT_WORKERS)) as executor:
+            return list(executor.map(self.generate_image_prompt, tweets))
+
+    def _encode_png(self, image_data):
+        """Legacy IMAGE_FIELD value: the image re-encoded as a base64 PNG"""
+        image = Image.open(BytesIO(image_data))
+
+        # Save to BytesIO and convert to base64
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+    def _image_value(self, image_id, image_data=None):
+        """IMAGE_FIELD value for a stored image, or None if it has been evicted"""
+        if IMAGE_PASSTHROUGH:
+            return image_url(image_id)
+        if image_data is None:
+            stored = get_image_store().read(image_id)
+            if stored is None:
+                return None
+            image_data = stored[0]
+        return self._encode_png(image_data)
+
+    def _cached_image(self, prompt):
+        """IMAGE_FIELD value for an image already generated from this prompt, or None"""
+        if image_cache is None:
+            return None
+        image_id = image_cache.get(prompt, IMAGE_MODEL)
+        return None if image_id is None else self._image_value(image_id)
+
+    def _extract_image(self, response, prompt):
+        """First inline image in a Gemini response as an IMAGE_FIELD value, or None.
+
+        The bytes are stored exactly as Gemini sent them and remembered in the
+        image cache under the prompt. In pass-through mode only their URL is
+        returned, so nothing is decoded or re-encoded.
+        """
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, 'inline_data') and part.inline_data is not None:
+                image_data = part.inline_data.data
+                if not IMAGE_PASSTHROUGH and image_cache is None:
+                    return self._encode_png(image_data)
+
+                mime_type = getattr(part.inline_data, 'mime_type', None) or "image/png"
+                image_id = get_image_store().put(image_data, mime_type)
+                if image_cache is not None:
+                    image_cache.set(prompt, IMAGE_MODEL, image_id)
+                return self._image_value(image_id, image_data)
+        
+        logger.warning("No image data found in response")
+        return None
+
     def generate_image(self, prompt):
-        """Generate an image using Gemini"""
+        """Generate an image using Gemini, or reuse one already drawn for the prompt"""
         try:
-            api_key = self.get_next_api_key()
-            from google import genai
-            from google.genai import types
-            
-            client = genai.Client(api_key=api_key)
-            
-            # Generate content using the correct method and configuration
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp-image-generation",
-                contents=[prompt],
-                config=types.GenerateContentConfig(
-                    response_modalities=['Text', 'Image']
+            cached = self._cached_image(prompt)
+            if cached is not None:
+                return cached
+
+            with key_pool.lease() as api_key, image_limiter.slot():
+                # Generate content using the correct method and configuration
+                response = gemini_clients.get(api_key).models.generate_content(
+                    model=IMAGE_MODEL,
+                    contents=[prompt],
+                    config=image_generation_config()
                 )
-            )
-            print("hoo")
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'inline_data') and part.inline_data is not None:
-                    image_data = part.inline_data.data
-                    image = Image.open(BytesIO(image_data))
-                    
-                    # Save to BytesIO and convert to base64
-                    buffered = BytesIO()
-                    image.save(buffered, format="PNG")
-                    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                    return img_str
-            
-            logger.warning("No image data found in response")
-            return None
+            return self._extract_image(response, prompt)
         
         except Exception as e:
             logger.error(f"Error generating image: {str(e)}")
@@ -484,8 +1251,8 @@ class EnhancedViralThreadGenerator:
                 "engine": "google"
             }
             
-            # Make the API request
-            response = requests.get("https://serpapi.com/search", params=params)
+            # Make the API request over the shared keep-alive session
+            response = get_session().get("https://serpapi.com/search", params=params)
             if response.status_code != 200:
                 raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
             
@@ -531,62 +1298,29 @@ class EnhancedViralThreadGenerator:
                 "related_searches": []
             }
 
+    def _action_plan_inputs(self, topic, thread_data, schedule):
+        # Extract tweet content
+        tweets = [tweet["content"] for tweet in thread_data]
+        tweets_text = "\n\n".join([f"Tweet {i+1}: {tweet}" for i, tweet in enumerate(tweets)])
+        
+        # Format schedule
+        schedule_text = "\n".join([
+            f"Tweet {item['tweet_number']}: {item['scheduled_time']}" 
+            for item in schedule
+        ])
+
+        return {
+            "topic": topic,
+            "tweets": tweets_text,
+            "schedule": schedule_text,
+            "current_date": self.get_current_date()
+        }
+
     def create_action_plan(self, topic, thread_data, schedule):
         """Generate an action plan based on the thread and insights"""
         try:
-            api_key = self.get_next_api_key()
-            genai.configure(api_key=api_key)
-            llm = GoogleGenerativeAI(model="gemini-1.5-pro", google_api_key=api_key)
-            
-            # Extract tweet content
-            tweets = [tweet["content"] for tweet in thread_data]
-            tweets_text = "\n\n".join([f"Tweet {i+1}: {tweet}" for i, tweet in enumerate(tweets)])
-            
-            # Format schedule
-            schedule_text = "\n".join([
-                f"Tweet {item['tweet_number']}: {item['scheduled_time']}" 
-                for item in schedule
-            ])
-            
-            # Create prompt for action plan
-            action_plan_prompt = PromptTemplate(
-                input_variables=["topic", "tweets", "schedule", "current_date"],
-                template="""
-                Create a comprehensive Action Plan for a viral Twitter thread campaign about "{topic}".
-                
-                Thread Content:
-                {tweets}
-                
-                Posting Schedule:
-                {schedule}
-                
-                Today's date: {current_date}
-                
-                Include in your action plan:
-                1. A catchy campaign name
-                2. Strategic objective (what this campaign aims to achieve)
-                3. Target audience analysis
-                4. Engagement tactics for each tweet
-                5. Recommendations for:
-                   - Hashtags to use
-                   - Accounts to tag
-                   - Follow-up content ideas
-                6. Metrics to track for success
-                7. Potential contingency plans for negative engagement
-                
-                Format this as a professional action plan that could be presented to a client.
-                """
-            )
-            
-            action_plan_chain = LLMChain(llm=llm, prompt=action_plan_prompt)
-            action_plan = action_plan_chain.run(
-                topic=topic,
-                tweets=tweets_text,
-                schedule=schedule_text,
-                current_date=self.get_current_date()
-            )
-            
-            return action_plan
+            action_plan_chain = self.create_chain(self.action_plan_template, cache_name="action_plan")
+            return action_plan_chain.run(**self._action_plan_inputs(topic, thread_data, schedule))
             
         except Exception as e:
             logger.error(f"Error creating action plan: {str(e)}")
@@ -595,14 +1329,6 @@ class EnhancedViralThreadGenerator:
     def schedule_in_calendar(self, email, schedule_data, topic):
         """Schedule tweets in Google Calendar using Composio"""
         try:
-            # Import directly like in your example
-            from google import genai
-            from google.genai import types
-            
-            # Initialize client correctly
-            api_key = self.get_next_api_key()
-            genai.configure(api_key=api_key)
-            
             # For Composio, ensure you have the right import
             from composio_gemini import Action, ComposioToolSet, App
             
@@ -612,37 +1338,37 @@ class EnhancedViralThreadGenerator:
                 apps=[App.GOOGLECALENDAR]
             )
             
-            # Create the chat with tools
-            model = genai.GenerativeModel(
-                "gemini-2.0-flash",
-                tools=tools
-            )
-            
-            chat = model.start_chat()
-            
-            # Create one calendar entry for each scheduled tweet
-            results = []
-            for item in schedule_data:
-                tweet_num = item["tweet_number"]
-                dt = item["datetime"]
-                
-                # Format the message for Composio
-                message = f"""
-                Create a Google Calendar event with these details:
-                Title: "Post Tweet #{tweet_num} for '{topic}' Thread"
-                Description: "Scheduled tweet for viral thread campaign about {topic}. Check your Twitter dashboard."
-                Start time: {dt.isoformat()}
-                End time: {(dt + timedelta(minutes=15)).isoformat()}
-                Add email notification 30 minutes before
-                """
+            # A multi-message tool chat, so it holds a slot without feeding its latency to the limiter
+            with key_pool.lease() as api_key, llm_limiter.slot(measure=False):
+                # Create the chat with tools on the shared client for this key
+                chat = gemini_clients.get(api_key).chats.create(
+                    model=CALENDAR_MODEL,
+                    config=types.GenerateContentConfig(tools=tools)
+                )
                 
-                # Send the message
-                response = chat.send_message(message)
-                results.append({
-                    "tweet_number": tweet_num,
-                    "scheduled_time": item["scheduled_time"],
-                    "composio_response": response.text
-                })
+                # Create one calendar entry for each scheduled tweet
+                results = []
+                for item in schedule_data:
+                    tweet_num = item["tweet_number"]
+                    dt = item["datetime"]
+                    
+                    # Format the message for Composio
+                    message = f"""
+                    Create a Google Calendar event with these details:
+                    Title: "Post Tweet #{tweet_num} for '{topic}' Thread"
+                    Description: "Scheduled tweet for viral thread campaign about {topic}. Check your Twitter dashboard."
+                    Start time: {dt.isoformat()}
+                    End time: {(dt + timedelta(minutes=15)).isoformat()}
+                    Add email notification 30 minutes before
+                    """
+                    
+                    # Send the message
+                    response = chat.send_message(message)
+                    results.append({
+                        "tweet_number": tweet_num,
+                        "scheduled_time": item["scheduled_time"],
+                        "composio_response": response.text
+                    })
             
             return results
         
@@ -650,183 +1376,531 @@ class EnhancedViralThreadGenerator:
             logger.error(f"Error scheduling in calendar: {str(e)}")
             return []
 
+    def generate_counterpoints(self, counterpoint_chain, topic, tweets, current_date):
+        """Generate optional counterpoints for a random subset of tweets in parallel"""
+        def generate_counterpoint(tweet):
+            if random.random() < 0.3:  # 30% chance for each tweet to get a counterpoint
+                try:
+                    counterpoint = counterpoint_chain.run(
+                        topic=topic,
+                        previous_tweet=tweet,
+                        current_date=current_date
+                    )
+                    return self.optimize_tweet(counterpoint.strip())
+                except Exception as e:
+                    logger.error(f"Error generating counterpoint: {str(e)}")
+                    return None
+            return None
+
+        if not tweets:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(tweets), FANOUT_WORKERS)) as executor:
+            potential_counterpoints = list(executor.map(generate_counterpoint, tweets))
+        return [cp for cp in potential_counterpoints if cp]
+
+    def assemble_thread(self, hook, supporting_tweets, opposing_tweets, counterpoints, finale, thread_count):
+        """Interleave the generated pieces with transitions and cap the thread length"""
+        transitions = [
+            "Now here's where it gets spicy... 👀",
+            "BUT WAIT bestie, consider this... 🤔",
+            "Plot twist incoming... 🌀",
+            "Hot take loading... 🔥",
+            "Unpopular opinion time... 💅",
+            "Let's flip the script real quick... 🔄",
+            "Tea time besties... ☕",
+            "The discourse™ continues... 🎭",
+            "Meanwhile, in another timeline... 🌌",
+            "Prepare for a reality check... ⚡"
+        ]
+        
+        # Interleave supporting and opposing tweets
+        middle_tweets = []
+        for s, o in zip(supporting_tweets, opposing_tweets):
+            if random.random() < 0.3:  # 30% chance for transition before supporting tweet
+                middle_tweets.append(random.choice(transitions))
+            middle_tweets.append(s)
+            if random.random() < 0.3:  # 30% chance for transition before opposing tweet
+                middle_tweets.append(random.choice(transitions))
+            middle_tweets.append(o)
+            
+        # Insert counterpoints randomly
+        for counterpoint in counterpoints:
+            position = random.randint(0, len(middle_tweets))
+            if random.random() < 0.3:  # 30% chance for transition before counterpoint
+                middle_tweets.insert(position, random.choice(transitions))
+            middle_tweets.insert(position, counterpoint)
+            
+        # Cap the thread length based on thread_count
+        all_tweets = [hook] + middle_tweets + [finale]
+        return all_tweets[:thread_count]
+
+    def process_tweets(self, tweets, on_tweet=None):
+        """Optimize the tweets in parallel, then create their image prompts.
+
+        ``on_tweet(index, tweet_data)`` is called for each tweet once its
+        image prompt is ready.
+        """
+        def optimize(tweet):
+            try:
+                return self.optimize_tweet(tweet)
+            except Exception as e:
+                logger.error(f"Error processing tweet: {str(e)}")
+                return tweet
+
+        tweets = [tweet for tweet in tweets if tweet]
+        if not tweets:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(tweets), FANOUT_WORKERS)) as executor:
+            optimized_tweets = list(executor.map(optimize, tweets))
+
+        image_prompts = self.generate_image_prompts(optimized_tweets)
+        processed_tweets = [
+            {"content": tweet, "image_prompt": image_prompt}
+            for tweet, image_prompt in zip(optimized_tweets, image_prompts)
+        ]
+        if on_tweet:
+            for index, tweet_data in enumerate(processed_tweets):
+                on_tweet(index, tweet_data)
+        return processed_tweets
+
+    def attach_images(self, processed_tweets, on_image=None, cancel_event=None):
+        """Return copies of the tweets with images for a random half, generated in parallel.
+
+        ``on_image(index, image)`` is called as each image finishes. An image
+        still running IMAGE_TIMEOUT seconds after it started is reported as
+        None. Once ``cancel_event`` is set, queued images are dropped and the
+        tweets are returned with whatever images have finished.
+        """
+        started = {}
+
+        def generate_tweet_image(index):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            started[index] = time.monotonic()
+            try:
+                return self.generate_image(tweets_with_images[index]["image_prompt"])
+            except Exception as e:
+                logger.error(f"Error generating image: {str(e)}")
+                return None
+
+        def settle(index, image):
+            tweets_with_images[index][IMAGE_FIELD] = image
+            if on_image:
+                on_image(index, image)
+
+        # Generate images for selected tweets (not all to avoid API overuse)
+        tweets_with_images = [dict(tweet_data, **{IMAGE_FIELD: None}) for tweet_data in processed_tweets]
+        # 50% chance to generate an image for each tweet
+        selected = [i for i in range(len(tweets_with_images)) if random.random() < 0.5]
+        if not selected:
+            return tweets_with_images
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(selected), FANOUT_WORKERS), thread_name_prefix="thread-images"
+        )
+        try:
+            pending = {executor.submit(generate_tweet_image, i): i for i in selected}
+            while pending:
+                if cancel_event is not None and cancel_event.is_set():
+                    logger.info(f"Image generation cancelled with {len(pending)} images outstanding")
+                    break
+                done, _ = concurrent.futures.wait(
+                    pending, timeout=IMAGE_CANCEL_POLL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    settle(pending.pop(future), future.result())
+
+                now = time.monotonic()
+                for future, index in list(pending.items()):
+                    if index in started and now - started[index] >= IMAGE_TIMEOUT:
+                        # The worker can't be interrupted; stop waiting for it
+                        logger.warning(f"Image for tweet {index} timed out after {IMAGE_TIMEOUT}s")
+                        settle(pending.pop(future), None)
+        finally:
+            # Don't hold the thread back for abandoned or cancelled images
+            executor.shutdown(wait=False, cancel_futures=True)
+        return tweets_with_images
+
+    def stream_chain(self, chain, on_token, **kwargs):
+        """Run a chain through the LLM's token stream, passing each chunk to on_token"""
+        return chain.stream(on_token, **kwargs)
+
+    def build_thread_graph(self, topic, thread_count=5, email=None, on_event=None, cancel_event=None):
+        """Express thread generation as a dependency graph of concurrent stages.
+
+        With ``on_event`` set, the hook is streamed token by token and each
+        tweet and image is reported as soon as it is ready. Setting
+        ``cancel_event`` also stops images that are still queued.
+        """
+        current_date = self.get_current_date()
+
+        # Create all chains; each call leases its own key from the pool
+        hook_chain = self.create_chain(self.hook_template, cache_name="hook")
+        thread_chain = self.create_chain(self.thread_template, cache_name="thread", json_mode=True, json_key="tweets")
+        counterpoint_chain = self.create_chain(self.counterpoint_template)
+        finale_chain = self.create_chain(self.finale_template, cache_name="finale")
+
+        def make_hook():
+            if on_event:
+                hook = self.stream_chain(
+                    hook_chain,
+                    lambda token: on_event({"type": "hook_token", "text": token}),
+                    topic=topic,
+                    current_date=current_date
+                )
+            else:
+                hook = hook_chain.run(topic=topic, current_date=current_date)
+            return self.optimize_tweet(hook.strip())
+
+        on_tweet = on_image = None
+        if on_event:
+            on_tweet = lambda index, tweet_data: on_event({"type": "tweet", "index": index, "tweet": tweet_data})
+            on_image = lambda index, image: on_event({"type": "image", "index": index, IMAGE_FIELD: image})
+
+        def make_perspective(perspective):
+            def run(hook):
+                content = thread_chain.run(
+                    topic=topic,
+                    hook=hook,
+                    perspective=perspective,
+                    current_date=current_date
+                )
+                return self.parse_thread_tweets(content)
+            return run
+
+        def make_finale():
+            finale = finale_chain.run(topic=topic, current_date=current_date)
+            return self.optimize_tweet(finale.strip())
+
+        graph = TaskGraph(max_workers=GRAPH_WORKERS, name="generate-thread")
+        graph.add("hook", make_hook, timeout=STAGE_TIMEOUTS["hook"])
+        graph.add("finale", make_finale, timeout=STAGE_TIMEOUTS["finale"])
+        graph.add("insights", lambda: self.get_topic_insights(topic),
+                  timeout=STAGE_TIMEOUTS["insights"],
+                  default={"top_news": [], "related_questions": [], "related_searches": []})
+        graph.add("supporting", make_perspective("supporting"), deps=["hook"], timeout=STAGE_TIMEOUTS["thread"])
+        graph.add("opposing", make_perspective("opposing"), deps=["hook"], timeout=STAGE_TIMEOUTS["thread"])
+        graph.add("counterpoints",
+                  lambda supporting, opposing: self.generate_counterpoints(
+                      counterpoint_chain, topic, supporting + opposing, current_date),
+                  deps=["supporting", "opposing"], timeout=STAGE_TIMEOUTS["counterpoints"], default=[])
+        graph.add("tweets",
+                  lambda hook, supporting, opposing, counterpoints, finale: self.assemble_thread(
+                      hook, supporting, opposing, counterpoints, finale, thread_count),
+                  deps=["hook", "supporting", "opposing", "counterpoints", "finale"])
+        graph.add("processed", lambda tweets: self.process_tweets(tweets, on_tweet),
+                  deps=["tweets"], timeout=STAGE_TIMEOUTS["processed"])
+        graph.add("images", lambda processed: self.attach_images(processed, on_image, cancel_event),
+                  deps=["processed"], timeout=STAGE_TIMEOUTS["images"], default=None)
+        graph.add("schedule", lambda processed: self.generate_posting_schedule(len(processed)),
+                  deps=["processed"])
+        # The action plan only needs tweet text, so it runs alongside image generation
+        graph.add("action_plan",
+                  lambda processed, schedule: self.create_action_plan(topic, processed, schedule),
+                  deps=["processed", "schedule"], timeout=STAGE_TIMEOUTS["action_plan"],
+                  default="Unable to generate action plan due to an error.")
+        graph.add("calendar",
+                  lambda schedule: self.schedule_in_calendar(email, schedule, topic) if email else [],
+                  deps=["schedule"], timeout=STAGE_TIMEOUTS["calendar"], default=[])
+        return graph
+
+    def _thread_data(self, topic, current_date, results):
+        """Combine graph results into the thread_data returned to clients"""
+        tweets_with_images = results["images"]
+        if tweets_with_images is None:
+            # Image stage timed out; return the tweets without images
+            tweets_with_images = [dict(tweet_data, **{IMAGE_FIELD: None}) for tweet_data in results["processed"]]
+
+        return {
+            "topic": topic,
+            "generated_date": current_date,
+            "tweets": tweets_with_images,
+            "schedule": results["schedule"],
+            "insights": results["insights"],
+            "action_plan": results["action_plan"],
+            "calendar": results["calendar"]
+        }
+
     def generate_thread(self, topic, thread_count=5, email=None):
         """Generate a complete viral thread with the given topic"""
         current_date = self.get_current_date()
         logger.info(f"Generating viral thread about: {topic} on {current_date}")
         
         try:
-            # Create all chains with fresh LLM instances
-            hook_chain = self.create_chain(self.hook_template)
-            thread_chain = self.create_chain(self.thread_template)
-            counterpoint_chain = self.create_chain(self.counterpoint_template)
-            finale_chain = self.create_chain(self.finale_template)
+            graph = self.build_thread_graph(topic, thread_count, email)
+            results = graph.run()
+            logger.info(f"Thread stage completion times (s): {graph.timings}")
+            return self._thread_data(topic, current_date, results)
             
-            # Generate hook
-            hook = hook_chain.run(topic=topic, current_date=current_date)
-            hook = self.optimize_tweet(hook.strip())
-            
-            # Generate supporting tweets
-            supporting_content = thread_chain.run(
-                topic=topic,
-                hook=hook,
-                perspective="supporting",
-                current_date=current_date
+        except Exception as e:
+            logger.error(f"Error generating thread: {str(e)}")
+            return {
+                "error": str(e),
+                "topic": topic,
+                "generated_date": current_date,
+                "tweets": []
+            }
+
+    def generate_thread_events(self, topic, thread_count=5, email=None, cancel_event=None):
+        """Yield thread generation progress as event dicts while stages finish.
+
+        Events are hook_token, hook, tweet, image, schedule (one per entry),
+        insights, action_plan, calendar, then a final done event carrying the
+        complete thread_data, or an error event. Closing the generator sets
+        ``cancel_event`` so no further stages are started.
+        """
+        current_date = self.get_current_date()
+        logger.info(f"Streaming viral thread about: {topic} on {current_date}")
+        cancel_event = cancel_event or threading.Event()
+        events = queue.Queue()
+
+        def on_complete(name, value):
+            if name == "hook":
+                events.put({"type": "hook", "text": value})
+            elif name == "schedule":
+                for entry in value:
+                    events.put({"type": "schedule", "entry": entry})
+            elif name in ("insights", "action_plan", "calendar"):
+                events.put({"type": name, name: value})
+
+        def run():
+            try:
+                graph = self.build_thread_graph(topic, thread_count, email, on_event=events.put,
+                                                cancel_event=cancel_event)
+                results = graph.run(on_complete=on_complete, cancel_event=cancel_event)
+                logger.info(f"Thread stage completion times (s): {graph.timings}")
+                events.put({"type": "done", "thread": self._thread_data(topic, current_date, results)})
+            except Exception as e:
+                if cancel_event.is_set():
+                    logger.info(f"Thread stream for {topic} cancelled by client")
+                else:
+                    logger.error(f"Error streaming thread: {str(e)}")
+                events.put({"type": "error", "error": str(e), "topic": topic, "generated_date": current_date})
+            finally:
+                events.put(None)
+
+        threading.Thread(target=run, name="generate-thread-stream", daemon=True).start()
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            cancel_event.set()
+
+    async def _arun(self, chain, **kwargs):
+        async with get_async_llm_semaphore():
+            return await chain.arun(**kwargs)
+
+    async def aoptimize_tweet(self, tweet):
+        """Async optimize_tweet"""
+        optimized = self._already_optimized(tweet)
+        if optimized is not None:
+            return optimized
+
+        style_metrics = self.style_analyzer.analyze_style(tweet)
+        if style_metrics["twitter_native_score"] >= OPTIMIZE_SCORE_THRESHOLD:
+            return self._remember_optimized(tweet, tweet)
+
+        try:
+            enhance_chain = self.create_chain(
+                self.enhance_template, cache_name="enhance", json_mode=True, json_key="candidates"
             )
-            supporting_tweets = supporting_content.strip().split('\n')
-            
-            # Generate opposing tweets
-            opposing_content = thread_chain.run(
+            completion = await self._arun(enhance_chain, tweet=tweet, candidates=OPTIMIZE_CANDIDATES)
+            candidates = await self.aparse_json_list(completion, "candidates", max_items=OPTIMIZE_CANDIDATES)
+            return self._remember_optimized(
+                tweet, self._best_candidate(tweet, style_metrics["twitter_native_score"], candidates)
+            )
+        except Exception as e:
+            logger.warning(f"Error optimizing tweet: {str(e)}")
+            return tweet
+
+    async def agenerate_image_prompts(self, tweets):
+        """Async generate_image_prompts"""
+        if IMAGE_PROMPT_BATCHING and len(tweets) > 1:
+            try:
+                chain = self.create_chain(
+                    self.image_prompts_template, cache_name="image_prompts", json_mode=True,
+                    json_key="prompts", json_count=len(tweets)
+                )
+                completion = await self._arun(chain, **self._image_prompts_inputs(tweets))
+                return self._parse_image_prompts(completion, len(tweets))
+            except Exception as e:
+                logger.warning(f"Batched image prompts failed, falling back to one call per tweet: {str(e)}")
+        return list(await asyncio.gather(*(self.agenerate_image_prompt(tweet) for tweet in tweets)))
+
+    async def agenerate_image_prompt(self, tweet_content):
+        """Async generate_image_prompt"""
+        try:
+            image_prompt_chain = self.create_chain(self.image_prompt_template, cache_name="image_prompt")
+            image_prompt = await self._arun(image_prompt_chain, tweet_content=tweet_content)
+            return image_prompt.strip()
+        except Exception as e:
+            logger.error(f"Error generating image prompt: {str(e)}")
+            return f"Social media image about {tweet_content[:50]}..."
+
+    async def agenerate_image(self, prompt):
+        """Async generate_image using the google-genai aio client"""
+        try:
+            # The image cache lookup is SQLite work; keep it off the event loop
+            cached = await asyncio.to_thread(self._cached_image, prompt)
+            if cached is not None:
+                return cached
+
+            async with get_async_llm_semaphore(), key_pool.alease() as api_key, image_limiter.aslot():
+                # Timed inside the slot so queueing for a key doesn't count against the image
+                response = await asyncio.wait_for(
+                    gemini_clients.get(api_key).aio.models.generate_content(
+                        model=IMAGE_MODEL,
+                        contents=[prompt],
+                        config=image_generation_config()
+                    ),
+                    IMAGE_TIMEOUT
+                )
+            # Storing the image can write files, evict and update the image cache
+            return await asyncio.to_thread(self._extract_image, response, prompt)
+
+        except Exception as e:
+            logger.error(f"Error generating image: {str(e)}")
+            return None
+
+    async def acreate_action_plan(self, topic, thread_data, schedule):
+        """Async create_action_plan"""
+        try:
+            action_plan_chain = self.create_chain(self.action_plan_template, cache_name="action_plan")
+            return await self._arun(action_plan_chain, **self._action_plan_inputs(topic, thread_data, schedule))
+        except Exception as e:
+            logger.error(f"Error creating action plan: {str(e)}")
+            return "Unable to generate action plan due to an error."
+
+    async def aattach_images(self, processed_tweets):
+        """Async attach_images"""
+        tweets_with_images = [dict(tweet_data, **{IMAGE_FIELD: None}) for tweet_data in processed_tweets]
+        # 50% chance to generate an image for each tweet
+        selected = [tweet_data for tweet_data in tweets_with_images if random.random() < 0.5]
+
+        images = await asyncio.gather(*(self.agenerate_image(t["image_prompt"]) for t in selected))
+        for tweet_data, image in zip(selected, images):
+            tweet_data[IMAGE_FIELD] = image
+        return tweets_with_images
+
+    async def agenerate_thread(self, topic, thread_count=5, email=None):
+        """Async generate_thread: the same stages, awaited on one event loop.
+
+        LLM and image calls use the async clients and share a per-loop
+        semaphore, so a single process can hold many generations in flight
+        without a thread per Gemini round trip.
+        """
+        current_date = self.get_current_date()
+        logger.info(f"Generating viral thread (async) about: {topic} on {current_date}")
+
+        hook_chain = self.create_chain(self.hook_template, cache_name="hook")
+        thread_chain = self.create_chain(self.thread_template, cache_name="thread", json_mode=True, json_key="tweets")
+        counterpoint_chain = self.create_chain(self.counterpoint_template)
+        finale_chain = self.create_chain(self.finale_template, cache_name="finale")
+
+        async def make_hook():
+            hook = await self._arun(hook_chain, topic=topic, current_date=current_date)
+            return await self.aoptimize_tweet(hook.strip())
+
+        async def make_perspective(hook, perspective):
+            content = await self._arun(
+                thread_chain,
                 topic=topic,
                 hook=hook,
-                perspective="opposing",
+                perspective=perspective,
                 current_date=current_date
             )
-            opposing_tweets = opposing_content.strip().split('\n')
-            
-            # Generate additional counterpoints in parallel
-            counterpoints = []
-            
-            def generate_counterpoint(tweet):
-                if random.random() < 0.3:  # 30% chance for each tweet to get a counterpoint
-                    try:
-                        counterpoint = counterpoint_chain.run(
-                            topic=topic,
-                            previous_tweet=tweet,
-                            current_date=current_date
-                        )
-                        return self.optimize_tweet(counterpoint.strip())
-                    except Exception as e:
-                        logger.error(f"Error generating counterpoint: {str(e)}")
-                        return None
-                return None
-            
-            # Generate counterpoints in parallel
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                all_tweets = supporting_tweets + opposing_tweets
-                potential_counterpoints = list(executor.map(generate_counterpoint, all_tweets))
-                counterpoints = [cp for cp in potential_counterpoints if cp]
-            
-            # Generate finale
-            finale = finale_chain.run(topic=topic, current_date=current_date)
-            finale = self.optimize_tweet(finale.strip())
-            
-            # Combine all tweets with transitions
-            transitions = [
-                "Now here's where it gets spicy... 👀",
-                "BUT WAIT bestie, consider this... 🤔",
-                "Plot twist incoming... 🌀",
-                "Hot take loading... 🔥",
-                "Unpopular opinion time... 💅",
-                "Let's flip the script real quick... 🔄",
-                "Tea time besties... ☕",
-                "The discourse™ continues... 🎭",
-                "Meanwhile, in another timeline... 🌌",
-                "Prepare for a reality check... ⚡"
-            ]
-            
-            # Interleave supporting and opposing tweets
-            middle_tweets = []
-            for s, o in zip(supporting_tweets, opposing_tweets):
-                if random.random() < 0.3:  # 30% chance for transition before supporting tweet
-                    middle_tweets.append(random.choice(transitions))
-                middle_tweets.append(s)
-                if random.random() < 0.3:  # 30% chance for transition before opposing tweet
-                    middle_tweets.append(random.choice(transitions))
-                middle_tweets.append(o)
-                
-            # Insert counterpoints randomly
-            for counterpoint in counterpoints:
-                position = random.randint(0, len(middle_tweets))
-                if random.random() < 0.3:  # 30% chance for transition before counterpoint
-                    middle_tweets.insert(position, random.choice(transitions))
-                middle_tweets.insert(position, counterpoint)
-                
-            # Cap the thread length based on thread_count
-            all_tweets = [hook] + middle_tweets + [finale]
-            all_tweets = all_tweets[:thread_count]
-            
-            # Generate metrics for each tweet and create image prompts in parallel
-            def process_tweet(tweet):
-                if not tweet:
-                    return None
-                
-                try:
-                    optimized_tweet = self.optimize_tweet(tweet)
-                    image_prompt = self.generate_image_prompt(optimized_tweet)
-                    
-                    return {
-                        "content": optimized_tweet,
-                        "image_prompt": image_prompt
-                    }
-                except Exception as e:
-                    logger.error(f"Error processing tweet: {str(e)}")
-                    return {"content": tweet, "image_prompt": "Error generating image prompt"}
-            
-            # Process all tweets in parallel
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                processed_tweets = list(executor.map(process_tweet, all_tweets))
-                processed_tweets = [t for t in processed_tweets if t]
-            
-            # Generate images for tweets in parallel
-            def generate_tweet_image(tweet_data):
+            return await self.aparse_thread_tweets(content)
+
+        async def make_finale():
+            finale = await self._arun(finale_chain, topic=topic, current_date=current_date)
+            return await self.aoptimize_tweet(finale.strip())
+
+        async def make_counterpoint(tweet):
+            if random.random() < 0.3:  # 30% chance for each tweet to get a counterpoint
                 try:
-                    image_base64 = self.generate_image(tweet_data["image_prompt"])
-                    tweet_data["image"] = image_base64
-                    return tweet_data
+                    counterpoint = await self._arun(
+                        counterpoint_chain,
+                        topic=topic,
+                        previous_tweet=tweet,
+                        current_date=current_date
+                    )
+                    return await self.aoptimize_tweet(counterpoint.strip())
                 except Exception as e:
-                    logger.error(f"Error generating image: {str(e)}")
-                    tweet_data["image"] = None
-                    return tweet_data
-            
-            # Generate images for selected tweets (not all to avoid API overuse)
-            tweets_with_images = []
-            for tweet_data in processed_tweets:
-                # 50% chance to generate an image for each tweet
-                if random.random() < 0.5:
-                    tweet_with_image = generate_tweet_image(tweet_data)
-                    tweets_with_images.append(tweet_with_image)
-                else:
-                    tweet_data["image"] = None
-                    tweets_with_images.append(tweet_data)
-            
-            # Generate posting schedule
-            schedule = self.generate_posting_schedule(len(tweets_with_images))
-            
-            # Get topic insights
-            insights = self.get_topic_insights(topic)
-            
-            # Create action plan
-            action_plan = self.create_action_plan(topic, tweets_with_images, schedule)
-            
-            # Schedule in calendar if email provided
-            calendar_results = []
+                    logger.error(f"Error generating counterpoint: {str(e)}")
+            return None
+
+        async def process_tweets(tweets):
+            optimized_tweets = await asyncio.gather(*(self.aoptimize_tweet(t) for t in tweets if t))
+            image_prompts = await self.agenerate_image_prompts(list(optimized_tweets))
+            return [
+                {"content": tweet, "image_prompt": image_prompt}
+                for tweet, image_prompt in zip(optimized_tweets, image_prompts)
+            ]
+
+        # Stages that don't depend on the hook start right away
+        finale_task = asyncio.create_task(asyncio.wait_for(make_finale(), STAGE_TIMEOUTS["finale"]))
+        # serpapi has no async client here, so this one call runs on the default executor
+        insights_task = asyncio.create_task(await_with_default(
+            asyncio.to_thread(self.get_topic_insights, topic), STAGE_TIMEOUTS["insights"],
+            {"top_news": [], "related_questions": [], "related_searches": []}, "insights"
+        ))
+
+        try:
+            hook = await asyncio.wait_for(make_hook(), STAGE_TIMEOUTS["hook"])
+            supporting_tweets, opposing_tweets = await asyncio.gather(
+                asyncio.wait_for(make_perspective(hook, "supporting"), STAGE_TIMEOUTS["thread"]),
+                asyncio.wait_for(make_perspective(hook, "opposing"), STAGE_TIMEOUTS["thread"])
+            )
+            counterpoints = await await_with_default(
+                asyncio.gather(*(make_counterpoint(t) for t in supporting_tweets + opposing_tweets)),
+                STAGE_TIMEOUTS["counterpoints"], [], "counterpoints"
+            )
+            finale = await finale_task
+
+            all_tweets = self.assemble_thread(
+                hook, supporting_tweets, opposing_tweets,
+                [cp for cp in counterpoints if cp], finale, thread_count
+            )
+            processed_tweets = await asyncio.wait_for(process_tweets(all_tweets), STAGE_TIMEOUTS["processed"])
+            schedule = self.generate_posting_schedule(len(processed_tweets))
+
+            # Images, the action plan and the calendar are independent of each other
+            stages = [
+                await_with_default(self.aattach_images(processed_tweets), STAGE_TIMEOUTS["images"],
+                                   None, "images"),
+                await_with_default(self.acreate_action_plan(topic, processed_tweets, schedule),
+                                   STAGE_TIMEOUTS["action_plan"],
+                                   "Unable to generate action plan due to an error.", "action_plan")
+            ]
             if email:
-                calendar_results = self.schedule_in_calendar(email, schedule, topic)
-            
-            # Combine everything into final result
-            thread_data = {
+                stages.append(await_with_default(
+                    asyncio.to_thread(self.schedule_in_calendar, email, schedule, topic),
+                    STAGE_TIMEOUTS["calendar"], [], "calendar"
+                ))
+            tweets_with_images, action_plan, *calendar = await asyncio.gather(*stages)
+            if tweets_with_images is None:
+                tweets_with_images = [dict(tweet_data, **{IMAGE_FIELD: None}) for tweet_data in processed_tweets]
+
+            return {
                 "topic": topic,
                 "generated_date": current_date,
                 "tweets": tweets_with_images,
                 "schedule": schedule,
-                "insights": insights,
+                "insights": await insights_task,
                 "action_plan": action_plan,
-                "calendar": calendar_results
+                "calendar": calendar[0] if calendar else []
             }
-            
-            return thread_data
-            
+
         except Exception as e:
+            finale_task.cancel()
+            insights_task.cancel()
             logger.error(f"Error generating thread: {str(e)}")
             return {
-                "error": str(e),
+                "error": str(e) or type(e).__name__,
                 "topic": topic,
                 "generated_date": current_date,
                 "tweets": []
             }
-
-
-
-
-
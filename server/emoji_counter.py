@@ -0,0 +1,52 @@
+# emoji_counter.py - Precompiled emoji matching for tweet metrics
+
+import re
+
+# Pictographs that render as emoji on their own
+_EMOJI_BASE = (
+    "\u231a\u231b\u2328\u23cf\u23e9-\u23f3\u23f8-\u23fa"
+    "\u2600-\u27bf"                      # misc symbols & dingbats
+    "\u2934\u2935\u2b05-\u2b07\u2b1b\u2b1c\u2b50\u2b55"
+    "\u3030\u303d\u3297\u3299"
+    "\U0001F004\U0001F0CF\U0001F18E\U0001F191-\U0001F19A"
+    "\U0001F201-\U0001F251"              # enclosed ideographic supplement
+    "\U0001F300-\U0001F3FA"              # symbols & pictographs (before skin tones)
+    "\U0001F400-\U0001F64F"              # pictographs & emoticons
+    "\U0001F680-\U0001F6FF"              # transport & map symbols
+    "\U0001F7E0-\U0001F7FF"              # geometric shapes extended
+    "\U0001F900-\U0001F9FF"              # supplemental symbols & pictographs
+    "\U0001FA70-\U0001FAFF"              # symbols & pictographs extended-A
+)
+
+# Symbols that are plain text unless followed by the emoji variation selector
+_TEXT_DEFAULT = "\xa9\xae\u203c\u2049\u2122\u2139\u2194-\u2199\u21a9\u21aa\u24c2\u25aa\u25ab\u25b6\u25c0\u25fb-\u25fe"
+
+_REGIONAL = "\U0001F1E6-\U0001F1FF"
+_MODIFIER = "\U0001F3FB-\U0001F3FF"
+
+_ELEMENT = (
+    f"(?:[{_EMOJI_BASE}]\uFE0F?[{_MODIFIER}]?"   # optional skin-tone modifier
+    f"|[{_TEXT_DEFAULT}]\uFE0F)"
+)
+
+# Subdivision flag tags, then any zero-width-joiner continuation
+_SEQUENCE_TAIL = f"(?:[\U000E0020-\U000E007E]+\U000E007F)?(?:\u200D{_ELEMENT})*"
+
+# One match per user-perceived emoji: flags, keycaps, tag and ZWJ sequences.
+# The pattern opens with a single character class so the regex engine can skip
+# ahead to candidate characters in C; lookbehinds then pick the right shape.
+EMOJI_PATTERN = re.compile(
+    f"[{_REGIONAL}0-9#*{_EMOJI_BASE}{_TEXT_DEFAULT}]"
+    f"(?:(?<=[{_REGIONAL}])[{_REGIONAL}]?"                      # flags
+    f"|(?<=[0-9#*])\uFE0F?\u20E3"                                # keycaps
+    f"|(?<=[{_EMOJI_BASE}])\uFE0F?[{_MODIFIER}]?{_SEQUENCE_TAIL}"
+    f"|(?<=[{_TEXT_DEFAULT}])\uFE0F{_SEQUENCE_TAIL})"
+)
+
+
+def count_emojis(text: str) -> int:
+    """Number of emoji grapheme clusters in text"""
+    # ASCII-only text can't contain emoji; str.isascii reads a cached flag
+    if text.isascii():
+        return 0
+    return len(EMOJI_PATTERN.findall(text))
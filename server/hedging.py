@@ -0,0 +1,246 @@
+# hedging.py - Hedged requests: race a backup call when the first one runs long
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class LeasedKeys(set):
+    """The ``used`` set handed to an attempt; calls ``on_lease`` when its first key is leased"""
+
+    def __init__(self, on_lease=None):
+        super().__init__()
+        self.on_lease = on_lease
+        self.leased_at = None
+
+    def add(self, key):
+        super().add(key)
+        if self.leased_at is None:
+            self.leased_at = time.monotonic()
+            if self.on_lease is not None:
+                self.on_lease()
+
+
+class HedgePolicy:
+    """Decides when to send a backup ("hedge") copy of a slow call.
+
+    Latencies are tracked per call name, from the moment a call has leased
+    its API key, so time spent queueing for a key never counts. Once
+    ``min_samples`` are known, a call still running ``percentile`` latency
+    after its lease gets a hedge on a different key. Each primary call adds
+    ``max_ratio`` to a small budget and each hedge spends 1, so hedges never
+    exceed that share of traffic even when everything is slow.
+
+    Whichever attempt succeeds first wins. In ``run`` each primary gets its
+    own thread, so the bounded executor only ever caps hedges; the losing
+    thread can't be interrupted and its result is dropped. ``arun`` cancels
+    the loser.
+    """
+
+    def __init__(self, max_ratio=0.1, percentile=95, min_samples=20, window=200,
+                 min_delay=0.5, max_workers=16):
+        self.max_ratio = max_ratio
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+        self._latencies = {}
+        self._budget = 0.0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {"calls": 0, "hedges": 0, "hedge_wins": 0, "budget_denied": 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="hedge"
+                )
+            return self._executor
+
+    def record(self, name, latency):
+        with self._lock:
+            self._latencies.setdefault(name, deque(maxlen=self.window)).append(latency)
+
+    def delay(self, name):
+        """Seconds after its lease to wait before hedging a call, or None until enough samples exist"""
+        with self._lock:
+            samples = sorted(self._latencies.get(name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(int(len(samples) * self.percentile / 100), len(samples) - 1)
+        return max(samples[index], self.min_delay)
+
+    def _start_call(self):
+        with self._lock:
+            self._stats["calls"] += 1
+            # Cap the budget so a long quiet spell can't fund a burst of hedges
+            self._budget = min(self._budget + self.max_ratio, 10 * self.max_ratio + 1)
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self._budget >= 1:
+                self._budget -= 1
+                self._stats["hedges"] += 1
+                return True
+            self._stats["budget_denied"] += 1
+            return False
+
+    def _hedge_won(self):
+        with self._lock:
+            self._stats["hedge_wins"] += 1
+
+    def _timed(self, name, attempt, exclude, leased):
+        start = time.monotonic()
+        result = attempt(exclude, leased)
+        self.record(name, time.monotonic() - (leased.leased_at or start))
+        return result
+
+    @staticmethod
+    def _spawn(fn, *args):
+        """Run fn(*args) on a thread of its own and return its Future"""
+        future = concurrent.futures.Future()
+
+        def target():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=target, name="hedge-primary", daemon=True).start()
+        return future
+
+    def run(self, name, attempt):
+        """Run ``attempt(exclude, used)``, hedging it once if it runs past the delay.
+
+        ``attempt`` must add the API key it leases to ``used`` and avoid the
+        keys in ``exclude``, so the hedge goes to a different key.
+        """
+        self._start_call()
+        delay = self.delay(name)
+        if delay is None:
+            return self._timed(name, attempt, (), LeasedKeys())
+
+        lock = threading.Lock()
+        wake = threading.Event()
+        state = {"finished": False, "hedge": None}
+
+        def hedge():
+            with lock:
+                if state["finished"] or not self._allow_hedge():
+                    return
+                logger.info(f"Hedging {name} call {delay:.2f}s after its lease")
+                state["hedge"] = self._get_executor().submit(
+                    self._timed, name, attempt, frozenset(primary_keys), LeasedKeys()
+                )
+                state["hedge"].add_done_callback(lambda _: wake.set())
+
+        timer = threading.Timer(delay, hedge)
+        timer.daemon = True
+        # The hedge clock starts once the primary holds a key, so key waits never trigger one
+        primary_keys = LeasedKeys(on_lease=timer.start)
+        primary = self._spawn(self._timed, name, attempt, (), primary_keys)
+        primary.add_done_callback(lambda _: wake.set())
+        try:
+            while True:
+                wake.wait()
+                wake.clear()
+                with lock:
+                    attempts = [future for future in (primary, state["hedge"]) if future is not None]
+                    for future in attempts:
+                        if future.done() and future.exception() is None:
+                            state["finished"] = True
+                            if future is not primary:
+                                self._hedge_won()
+                            # The loser can't be interrupted; its result is simply dropped
+                            return future.result()
+                    if all(future.done() for future in attempts):
+                        # Every attempt failed, and with the primary done no hedge can start
+                        state["finished"] = True
+                        raise attempts[-1].exception()
+        finally:
+            timer.cancel()
+
+    async def arun(self, name, attempt):
+        """Async run: ``attempt(exclude, used)`` returns an awaitable; the loser is cancelled"""
+        self._start_call()
+        delay = self.delay(name)
+
+        async def timed(exclude, leased):
+            start = time.monotonic()
+            result = await attempt(exclude, leased)
+            self.record(name, time.monotonic() - (leased.leased_at or start))
+            return result
+
+        if delay is None:
+            return await timed((), LeasedKeys())
+
+        leased = asyncio.Event()
+        primary_keys = LeasedKeys(on_lease=leased.set)
+        primary = asyncio.ensure_future(timed((), primary_keys))
+        lease_wait = asyncio.ensure_future(leased.wait())
+        try:
+            # The hedge clock starts once the primary holds a key, so key waits never trigger one
+            await asyncio.wait({primary, lease_wait}, return_when=asyncio.FIRST_COMPLETED)
+            if not primary.done():
+                await asyncio.wait({primary}, timeout=delay)
+        finally:
+            lease_wait.cancel()
+        if primary.done() or not self._allow_hedge():
+            return await primary
+
+        logger.info(f"Hedging {name} call {delay:.2f}s after its lease")
+        hedge = asyncio.ensure_future(timed(frozenset(primary_keys), LeasedKeys()))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._hedge_won()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            names = list(self._latencies)
+        stats["hedge_delay"] = {name: self.delay(name) for name in names}
+        return stats
+
+
+class HedgedChain:
+    """Wraps a PooledChain so run/arun go through a HedgePolicy under ``name``"""
+
+    def __init__(self, chain, policy, name):
+        self.chain = chain
+        self.policy = policy
+        self.name = name
+
+    @property
+    def prompt(self):
+        return self.chain.prompt
+
+    def run(self, **kwargs):
+        return self.policy.run(self.name, lambda exclude, used: self.chain.call(kwargs, exclude, used))
+
+    def stream(self, on_token, **kwargs):
+        # Tokens from two racing streams can't be merged, so streams are never hedged
+        return self.chain.stream(on_token, **kwargs)
+
+    async def arun(self, **kwargs):
+        return await self.policy.arun(self.name, lambda exclude, used: self.chain.acall(kwargs, exclude, used))
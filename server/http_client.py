@@ -0,0 +1,125 @@
+# http_client.py - Shared, pooled HTTP transport for outbound API calls
+
+import importlib.util
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive connections kept per host, and how long an idle one is reused
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 32))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", 30))
+
+# Default (connect, read) timeouts in seconds for requests made through the session
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 30))
+
+# Retries for idempotent requests on connection errors and 502/503/504
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+
+# httpx only negotiates HTTP/2 when the h2 package is installed
+HTTP2_ENABLED = (
+    httpx is not None
+    and importlib.util.find_spec("h2") is not None
+    and os.environ.get("HTTP2_DISABLED") != "1"
+)
+
+
+class PooledSession(requests.Session):
+    """requests.Session with a sized keep-alive pool, retries and default timeouts.
+
+    Only GET/HEAD/OPTIONS are retried, so a POST that creates something
+    (a phone call, an order) is never sent twice.
+    """
+
+    def __init__(self, pool_maxsize=HTTP_POOL_MAXSIZE, retries=HTTP_RETRIES,
+                 timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+_session = None
+_httpx_client = None
+_lock = threading.Lock()
+
+def get_session():
+    """Process-wide PooledSession, created on first use"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = PooledSession()
+    return _session
+
+
+def httpx_client_args(timeout=HTTP_READ_TIMEOUT):
+    """Keyword arguments for an httpx client using this module's pool settings"""
+    return {
+        "http2": HTTP2_ENABLED,
+        "limits": httpx.Limits(
+            max_connections=HTTP_POOL_MAXSIZE,
+            max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+        ),
+        "timeout": httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)
+    }
+
+
+def get_httpx_client():
+    """Process-wide httpx.Client (HTTP/2 when available), or None without httpx"""
+    global _httpx_client
+    if httpx is None:
+        return None
+    if _httpx_client is None:
+        with _lock:
+            if _httpx_client is None:
+                _httpx_client = httpx.Client(follow_redirects=True, **httpx_client_args())
+                logger.info(f"Shared httpx client created (HTTP/2 {'on' if HTTP2_ENABLED else 'off'})")
+    return _httpx_client
+
+
+def gemini_http_options(timeout_seconds):
+    """HttpOptions for google.genai clients so they share one pooled transport.
+
+    Every per-key Client reuses the same sync httpx client, so connections to
+    the Gemini endpoint are kept alive across keys and requests. Async clients
+    are bound to an event loop, so each gets its own pool with the same
+    limits. Older google-genai versions without these options only get the
+    timeout.
+    """
+    from google.genai import types
+
+    fields = getattr(types.HttpOptions, "model_fields", {})
+    options = {"timeout": int(timeout_seconds * 1000)}
+    if httpx is not None:
+        if "httpx_client" in fields:
+            options["httpx_client"] = get_httpx_client()
+        elif "client_args" in fields:
+            options["client_args"] = httpx_client_args(timeout_seconds)
+        if "async_client_args" in fields:
+            options["async_client_args"] = httpx_client_args(timeout_seconds)
+    return types.HttpOptions(**options)
@@ -0,0 +1,213 @@
+# image_cache.py - Reuse generated images for prompts we've already drawn
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# MinHash signature length, split into LSH bands of MINHASH_ROWS values each;
+# prompts sharing any band are compared on their full signatures
+MINHASH_PERMUTATIONS = 64
+MINHASH_ROWS = 4
+SHINGLE_WORDS = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1337)
+# Multipliers stay below 2**31 and shingle hashes below 2**32, so a*x + b fits in 64 bits
+_PERM_A = _rng.randint(1, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=MINHASH_PERMUTATIONS).astype(np.uint64)
+
+
+def normalize_prompt(prompt):
+    """Lowercased prompt with punctuation dropped and whitespace collapsed"""
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", prompt.lower())).strip()
+
+
+def minhash_signature(normalized):
+    """MinHash of a normalized prompt's word shingles, as uint64s"""
+    words = normalized.split()
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "big") for s in shingles],
+        dtype=np.uint64
+    )
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return permuted.min(axis=0)
+
+
+class ImageCache:
+    """Maps (model, normalized prompt) to an image id in the ImageStore.
+
+    Exact lookups hash the normalized prompt. With ``similarity`` set,
+    a miss falls back to MinHash near-duplicate search: a stored prompt whose
+    estimated word-shingle Jaccard similarity reaches the threshold is
+    treated as the same picture. The index lives in SQLite so every worker
+    process shares it. It keeps at most ``max_entries`` prompts,
+    least recently used first out; the image bytes are bounded by the image
+    store's own budget, and entries whose image was evicted count as misses.
+    """
+
+    def __init__(self, db_path, store, max_entries=10000, similarity=None):
+        self.db_path = db_path
+        self.store = store
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "near_hits": 0, "misses": 0, "writes": 0, "stale": 0}
+
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS image_cache ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, image_id TEXT NOT NULL, "
+            "signature BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS image_cache_bands ("
+            "band TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (band, key))"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS image_cache_last_used ON image_cache (last_used)")
+        connection.commit()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def make_key(normalized, model):
+        return hashlib.sha256(f"{model}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _bands(model, signature):
+        """LSH band ids for a signature; prompts for different models never share one"""
+        return [
+            hashlib.sha1(f"{model}\x00{i}\x00".encode("utf-8") + signature[i:i + MINHASH_ROWS].tobytes()).hexdigest()
+            for i in range(0, MINHASH_PERMUTATIONS, MINHASH_ROWS)
+        ]
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _live(self, connection, key, image_id):
+        """True if the entry's image is still in the store; drops the entry otherwise"""
+        if self.store.locate(image_id) is not None:
+            connection.execute("UPDATE image_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            return True
+        self._count("stale")
+        self._delete(connection, [key])
+        return False
+
+    def _delete(self, connection, keys):
+        connection.executemany("DELETE FROM image_cache WHERE key = ?", [(k,) for k in keys])
+        connection.executemany("DELETE FROM image_cache_bands WHERE key = ?", [(k,) for k in keys])
+        connection.commit()
+
+    def get(self, prompt, model):
+        """Image id previously generated for this prompt (or a near-duplicate), or None"""
+        normalized = normalize_prompt(prompt)
+        key = self.make_key(normalized, model)
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT image_id FROM image_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._live(connection, key, row[0]):
+                self._count("exact_hits")
+                return row[0]
+
+            if self.similarity:
+                signature = minhash_signature(normalized)
+                bands = self._bands(model, signature)
+                rows = connection.execute(
+                    "SELECT DISTINCT c.key, c.image_id, c.signature FROM image_cache_bands b "
+                    "JOIN image_cache c ON c.key = b.key "
+                    f"WHERE b.band IN ({','.join('?' * len(bands))})",
+                    bands
+                ).fetchall()
+                best = None
+                for candidate_key, image_id, blob in rows:
+                    score = float(np.mean(np.frombuffer(blob, dtype=np.uint64) == signature))
+                    if score >= self.similarity and (best is None or score > best[0]):
+                        best = (score, candidate_key, image_id)
+                if best is not None and self._live(connection, best[1], best[2]):
+                    self._count("near_hits")
+                    return best[2]
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading image cache: {str(e)}")
+
+        self._count("misses")
+        return None
+
+    def set(self, prompt, model, image_id):
+        """Remember that prompt produced image_id"""
+        normalized = normalize_prompt(prompt)
+        key = self.make_key(normalized, model)
+        signature = minhash_signature(normalized)
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO image_cache (key, model, image_id, signature, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, image_id, signature.tobytes(), time.time())
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO image_cache_bands (band, key) VALUES (?, ?)",
+                [(band, key) for band in self._bands(model, signature)]
+            )
+            connection.commit()
+            self._count("writes")
+
+            with self._lock:
+                trim = self._stats["writes"] % 100 == 0
+            if trim:
+                self._trim(connection)
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing image cache: {str(e)}")
+
+    def _trim(self, connection):
+        """Drop the least recently used entries beyond max_entries"""
+        keys = [row[0] for row in connection.execute(
+            "SELECT key FROM image_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_entries,)
+        )]
+        if keys:
+            self._delete(connection, keys)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            stats["entries"] = self._connection().execute("SELECT COUNT(*) FROM image_cache").fetchone()[0]
+        except sqlite3.Error:
+            stats["entries"] = None
+        stats["similarity"] = self.similarity
+        return stats
+
+
+def create_image_cache(store):
+    """Cache configured from IMAGE_CACHE_* environment variables, or None if disabled"""
+    if os.environ.get("IMAGE_CACHE_DISABLED") == "1":
+        return None
+    similarity = float(os.environ.get("IMAGE_CACHE_SIMILARITY", 0)) or None
+    db_path = os.environ.get("IMAGE_CACHE_PATH", "image_cache.sqlite3")
+    try:
+        return ImageCache(
+            db_path,
+            store,
+            max_entries=int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", 10000)),
+            similarity=similarity
+        )
+    except sqlite3.Error as e:
+        logger.error(f"Disabling image cache at {db_path}: {str(e)}")
+        return None
@@ -0,0 +1,278 @@
+# image_store.py - Content-addressed store for generated images, served by URL
+
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Directory generated images are written to
+IMAGE_STORE_PATH = os.environ.get("IMAGE_STORE_PATH", "image_store")
+
+# Disk budget for stored images; least recently used ones are evicted beyond it
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", 1024 ** 3))
+
+# Store Gemini's image bytes as received and return URLs instead of base64 PNGs
+IMAGE_PASSTHROUGH = os.environ.get("IMAGE_PASSTHROUGH", "1") == "1"
+
+# Content-addressed images never change, so clients may cache them for good
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Reads refresh an image's recency at most this often, to avoid a write per hit
+TOUCH_INTERVAL_SECONDS = 60
+
+# Eviction trims the store to this fraction of the budget so it doesn't run on every put
+EVICT_TO_RATIO = 0.9
+
+MIME_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif"
+}
+
+_IMAGE_ID = re.compile(r"^[0-9a-f]{64}$")
+_IMAGE_URL = re.compile(r"^/images/([0-9a-f]{64})$")
+
+
+def image_url(image_id):
+    return f"/images/{image_id}"
+
+
+def image_id_from_url(url):
+    """The image id in a /images/<hash> URL, or None"""
+    match = _IMAGE_URL.match(url or "")
+    return match.group(1) if match else None
+
+
+class ImageStore:
+    """Images on disk named by the SHA-256 of their bytes.
+
+    The same bytes always get the same id, so storing an image twice only
+    refreshes it, and the id doubles as a strong ETag. Files are sharded into
+    256 subdirectories by the first two hex digits and written to a temp
+    file first, so a reader never sees half an image. When the store grows
+    past ``max_bytes`` the least recently used images are deleted; recency is
+    the file's mtime, so it is shared by every process using the directory.
+    """
+
+    def __init__(self, root=IMAGE_STORE_PATH, max_bytes=IMAGE_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self._stats = {"puts": 0, "dedup_hits": 0, "evictions": 0, "evicted_bytes": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _shard(self, image_id):
+        return os.path.join(self.root, image_id[:2])
+
+    def _path(self, image_id, extension):
+        return os.path.join(self._shard(image_id), f"{image_id}.{extension}")
+
+    def _variant_path(self, image_id, width, extension):
+        return os.path.join(self._shard(image_id), f"{image_id}.w{width}.{extension}")
+
+    def _touch(self, path, force=False):
+        try:
+            if force or time.time() - os.path.getmtime(path) >= TOUCH_INTERVAL_SECONDS:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def put(self, data, mime_type="image/png"):
+        """Store image bytes unchanged and return their id"""
+        image_id = hashlib.sha256(data).hexdigest()
+        path = self._path(image_id, MIME_EXTENSIONS.get(mime_type, "png"))
+        with self._lock:
+            self._stats["puts"] += 1
+        if os.path.exists(path):
+            with self._lock:
+                self._stats["dedup_hits"] += 1
+            self._touch(path, force=True)
+            return image_id
+
+        self._write(path, data)
+        return image_id
+
+    def _write(self, path, data):
+        """Write a file atomically, then evict if the store is over budget"""
+        shard = os.path.dirname(path)
+        os.makedirs(shard, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=shard, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data)
+        if self.max_bytes and self._current_bytes() > self.max_bytes:
+            self.evict()
+
+    def put_variant(self, image_id, width, extension, data):
+        """Store a resized rendition of an image; evicted like any other file"""
+        path = self._variant_path(image_id, width, extension)
+        self._write(path, data)
+        return path
+
+    def locate_variant(self, image_id, width, extension):
+        """Path of a stored rendition, or None"""
+        if not _IMAGE_ID.match(image_id or ""):
+            return None
+        path = self._variant_path(image_id, width, extension)
+        if not os.path.exists(path):
+            return None
+        self._touch(path)
+        return path
+
+    def locate(self, image_id, touch=True):
+        """(path, mime_type) of a stored image, or None for unknown or malformed ids"""
+        if not _IMAGE_ID.match(image_id or ""):
+            return None
+        for mime_type, extension in MIME_EXTENSIONS.items():
+            path = self._path(image_id, extension)
+            if os.path.exists(path):
+                if touch:
+                    self._touch(path)
+                return path, mime_type
+        return None
+
+    def read(self, image_id):
+        """(bytes, mime_type) of a stored image, or None"""
+        located = self.locate(image_id)
+        if located is None:
+            return None
+        path, mime_type = located
+        try:
+            with open(path, "rb") as f:
+                return f.read(), mime_type
+        except FileNotFoundError:
+            # Evicted between locate and open
+            return None
+
+    def touch(self, image_ids):
+        """Mark images as just used, e.g. when a saved thread references them"""
+        for image_id in image_ids:
+            located = self.locate(image_id, touch=False)
+            if located is not None:
+                self._touch(located[0], force=True)
+
+    def _scan(self):
+        """(mtime, size, path) of every stored image"""
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _current_bytes(self):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            return self._total_bytes
+
+    def evict(self):
+        """Delete least recently used images until the store is under its budget"""
+        with self._lock:
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * EVICT_TO_RATIO
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._stats["evictions"] += 1
+                self._stats["evicted_bytes"] += size
+            self._total_bytes = total
+        logger.info(f"Image store trimmed to {total} bytes")
+
+    def get_stats(self):
+        total = self._current_bytes()
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({"bytes": total, "max_bytes": self.max_bytes})
+        return stats
+
+
+def externalize_images(thread_data, store=None):
+    """Copy of thread_data whose inline base64 tweet images are moved into the store.
+
+    Each such tweet gets an image_url reference instead, so saved threads and
+    request bodies carry ids rather than image bytes. Images that are already
+    references are marked as recently used so eviction keeps them.
+    """
+    store = store or get_image_store()
+    tweets = []
+    referenced = []
+    for tweet in thread_data.get("tweets") or []:
+        tweet = dict(tweet)
+        image = tweet.get("image")
+        if isinstance(image, str) and image:
+            try:
+                image_id = store.put(base64.b64decode(image, validate=True))
+                tweet["image_url"] = image_url(image_id)
+                del tweet["image"]
+            except (binascii.Error, ValueError) as e:
+                logger.warning(f"Dropping undecodable inline image: {str(e)}")
+                tweet["image"] = None
+        image_id = image_id_from_url(tweet.get("image_url"))
+        if image_id:
+            referenced.append(image_id)
+        tweets.append(tweet)
+    store.touch(referenced)
+    return dict(thread_data, tweets=tweets)
+
+
+def etag_for(image_id):
+    return f'"{image_id}"'
+
+
+def etag_matches(image_id, if_none_match):
+    """True if an If-None-Match header already names this image"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag_for(image_id) in tags or f"W/{etag_for(image_id)}" in tags
+
+
+def image_headers(image_id):
+    return {"ETag": etag_for(image_id), "Cache-Control": IMAGE_CACHE_CONTROL}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_image_store():
+    """Process-wide ImageStore, created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ImageStore()
+    return _store
@@ -0,0 +1,161 @@
+# image_variants.py - Resized WebP/AVIF renditions of stored images, rendered off the GIL
+
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+from io import BytesIO
+
+from PIL import Image, features
+
+from image_store import get_image_store
+
+logger = logging.getLogger(__name__)
+
+# Widths a rendition may be requested at; anything else is rejected so the
+# cache can't be filled with arbitrary sizes
+IMAGE_VARIANT_WIDTHS = tuple(
+    int(width) for width in os.environ.get("IMAGE_VARIANT_WIDTHS", "160,320,640,1024").split(",")
+)
+
+# Processes doing the PIL decode/resize/encode work
+IMAGE_VARIANT_WORKERS = int(os.environ.get("IMAGE_VARIANT_WORKERS", 2))
+
+IMAGE_VARIANT_QUALITY = int(os.environ.get("IMAGE_VARIANT_QUALITY", 80))
+
+# Seconds a request waits for a rendition before giving up
+IMAGE_VARIANT_TIMEOUT = float(os.environ.get("IMAGE_VARIANT_TIMEOUT", 30))
+
+
+def _supports(feature):
+    try:
+        return bool(features.check(feature))
+    except ValueError:
+        # Pillow versions that predate the feature don't know its name
+        return False
+
+
+# Format name -> (PIL format, mime type, file extension)
+VARIANT_FORMATS = {"webp": ("WEBP", "image/webp", "webp")}
+if os.environ.get("IMAGE_VARIANT_AVIF", "1") == "1" and _supports("avif"):
+    VARIANT_FORMATS["avif"] = ("AVIF", "image/avif", "avif")
+
+
+def render_variant(data, width, pil_format, quality=IMAGE_VARIANT_QUALITY):
+    """Image bytes scaled down to at most width pixels wide and encoded as pil_format.
+
+    Module-level so it can run in a worker process.
+    """
+    image = Image.open(BytesIO(data))
+    if image.width > width:
+        image.thumbnail((width, image.height * width // image.width), Image.LANCZOS)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    buffered = BytesIO()
+    image.save(buffered, format=pil_format, quality=quality)
+    return buffered.getvalue()
+
+
+class VariantService:
+    """Renders and caches (image, width, format) renditions.
+
+    Renditions are stored next to their original in the ImageStore, so they
+    share its eviction budget. Rendering runs in a process pool, and
+    concurrent requests for the same rendition wait on a single render.
+    """
+
+    def __init__(self, store=None, workers=IMAGE_VARIANT_WORKERS):
+        self.store = store or get_image_store()
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "renders": 0, "render_errors": 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawn, not fork: forking this multithreaded server can copy a held lock into the child
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def negotiate(self, accept):
+        """Best rendition format for an Accept header: AVIF, then WebP"""
+        accept = accept or ""
+        if "avif" in VARIANT_FORMATS and "image/avif" in accept:
+            return "avif"
+        return "webp"
+
+    def get(self, image_id, width, fmt):
+        """(path, mime_type) of the rendition, rendering it if needed; None if the image is unknown.
+
+        Raises ValueError for widths or formats that aren't offered.
+        """
+        if width not in IMAGE_VARIANT_WIDTHS:
+            raise ValueError(f"Unsupported width {width}; choose from {IMAGE_VARIANT_WIDTHS}")
+        if fmt not in VARIANT_FORMATS:
+            raise ValueError(f"Unsupported format {fmt}; choose from {sorted(VARIANT_FORMATS)}")
+        pil_format, mime_type, extension = VARIANT_FORMATS[fmt]
+
+        path = self.store.locate_variant(image_id, width, extension)
+        if path is not None:
+            with self._lock:
+                self._stats["hits"] += 1
+            return path, mime_type
+
+        key = (image_id, width, fmt)
+        with self._lock:
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = concurrent.futures.Future()
+
+        if owner:
+            try:
+                future.set_result(self._render(image_id, width, pil_format, extension))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+
+        path = future.result(timeout=IMAGE_VARIANT_TIMEOUT)
+        return (path, mime_type) if path is not None else None
+
+    def _render(self, image_id, width, pil_format, extension):
+        original = self.store.read(image_id)
+        if original is None:
+            return None
+        try:
+            data = self._get_executor().submit(
+                render_variant, original[0], width, pil_format
+            ).result(timeout=IMAGE_VARIANT_TIMEOUT)
+        except Exception:
+            with self._lock:
+                self._stats["render_errors"] += 1
+            raise
+        with self._lock:
+            self._stats["renders"] += 1
+        return self.store.put_variant(image_id, width, extension, data)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["formats"] = sorted(VARIANT_FORMATS)
+        return stats
+
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_variant_service():
+    """Process-wide VariantService, created on first use"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = VariantService()
+    return _service
@@ -0,0 +1,501 @@
+# key_pool.py - Quota-aware API key pool shared by every Gemini caller
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Substrings of provider errors that mean "this key is rate limited or overloaded"
+RATE_LIMIT_MARKERS = ("429", "503", "resource exhausted", "resource_exhausted", "quota", "rate limit", "overloaded")
+
+# Length of the sliding window that RPM/TPM budgets are measured over
+WINDOW_SECONDS = 60
+
+
+class NoKeyAvailable(Exception):
+    """Every key is cooling down or out of budget"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"No API key available, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def is_rate_limit_error(error):
+    """Whether an exception (or message) looks like a 429/503 from the provider"""
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+def mask_key(key):
+    return f"...{key[-6:]}"
+
+
+def key_id(key):
+    """Stable identifier for a key that doesn't reveal it when persisted"""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+class MemoryKeyStore:
+    """Per-key usage windows and health kept in this process only"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._requests = {}
+        self._tokens = {}
+        self._health = {}
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            yield
+
+    def _health_for(self, key):
+        return self._health.setdefault(key, {
+            "cooldown_until": 0.0, "consecutive_failures": 0, "latency_ewma": None,
+            "successes": 0, "failures": 0, "rate_limited": 0
+        })
+
+    def load(self, keys, now):
+        """Usage in the current window and health for each key"""
+        snapshot = {}
+        for key in keys:
+            requests = self._requests.setdefault(key, deque())
+            tokens = self._tokens.setdefault(key, deque())
+            while requests and requests[0] <= now - WINDOW_SECONDS:
+                requests.popleft()
+            while tokens and tokens[0][0] <= now - WINDOW_SECONDS:
+                tokens.popleft()
+            entry = dict(self._health_for(key))
+            entry.update({
+                "requests": len(requests),
+                "requests_reset": requests[0] + WINDOW_SECONDS - now if requests else 0,
+                "tokens": sum(count for _, count in tokens),
+                "tokens_reset": tokens[0][0] + WINDOW_SECONDS - now if tokens else 0
+            })
+            snapshot[key] = entry
+        return snapshot
+
+    def record_usage(self, key, now, requests=1, tokens=0):
+        if requests:
+            self._requests.setdefault(key, deque()).extend([now] * requests)
+        if tokens:
+            self._tokens.setdefault(key, deque()).append((now, tokens))
+
+    def update_health(self, key, **fields):
+        self._health_for(key).update(fields)
+
+    def get_health(self, key):
+        return dict(self._health_for(key))
+
+
+class SQLiteKeyStore:
+    """Per-key usage windows and health in a SQLite WAL file.
+
+    Every worker process on the host that points at the same file sees the
+    same budgets and cooldowns. Usage is bucketed per second and incremented
+    with upserts inside ``BEGIN IMMEDIATE`` transactions, so selecting a key
+    and charging it is atomic across processes. Keys are stored hashed.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS key_usage ("
+            "key_id TEXT NOT NULL, second INTEGER NOT NULL, "
+            "requests INTEGER NOT NULL DEFAULT 0, tokens INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (key_id, second))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS key_health ("
+            "key_id TEXT PRIMARY KEY, cooldown_until REAL NOT NULL DEFAULT 0, "
+            "consecutive_failures INTEGER NOT NULL DEFAULT 0, latency_ewma REAL, "
+            "successes INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0, "
+            "rate_limited INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        connection = self._connection()
+        if connection.in_transaction:
+            yield
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def load(self, keys, now):
+        """Usage in the current window and health for each key"""
+        connection = self._connection()
+        connection.execute("DELETE FROM key_usage WHERE second <= ?", (int(now) - WINDOW_SECONDS,))
+
+        usage = {}
+        for row in connection.execute(
+            "SELECT key_id, SUM(requests), SUM(tokens), "
+            "MIN(CASE WHEN requests > 0 THEN second END), MIN(CASE WHEN tokens > 0 THEN second END) "
+            "FROM key_usage GROUP BY key_id"
+        ):
+            usage[row[0]] = row[1:]
+
+        health = {}
+        for row in connection.execute(
+            "SELECT key_id, cooldown_until, consecutive_failures, latency_ewma, "
+            "successes, failures, rate_limited FROM key_health"
+        ):
+            health[row[0]] = row[1:]
+
+        snapshot = {}
+        for key in keys:
+            ident = key_id(key)
+            requests, tokens, first_request, first_token = usage.get(ident, (0, 0, None, None))
+            cooldown_until, consecutive, latency, successes, failures, rate_limited = health.get(
+                ident, (0.0, 0, None, 0, 0, 0)
+            )
+            # Buckets are whole seconds, so a bucket expires at the end of its second
+            snapshot[key] = {
+                "requests": requests or 0,
+                "requests_reset": first_request + 1 + WINDOW_SECONDS - now if first_request is not None else 0,
+                "tokens": tokens or 0,
+                "tokens_reset": first_token + 1 + WINDOW_SECONDS - now if first_token is not None else 0,
+                "cooldown_until": cooldown_until,
+                "consecutive_failures": consecutive,
+                "latency_ewma": latency,
+                "successes": successes,
+                "failures": failures,
+                "rate_limited": rate_limited
+            }
+        return snapshot
+
+    def record_usage(self, key, now, requests=1, tokens=0):
+        self._connection().execute(
+            "INSERT INTO key_usage (key_id, second, requests, tokens) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key_id, second) DO UPDATE SET "
+            "requests = requests + excluded.requests, tokens = tokens + excluded.tokens",
+            (key_id(key), int(now), requests, tokens)
+        )
+
+    def update_health(self, key, **fields):
+        connection = self._connection()
+        connection.execute("INSERT OR IGNORE INTO key_health (key_id) VALUES (?)", (key_id(key),))
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        connection.execute(
+            f"UPDATE key_health SET {assignments} WHERE key_id = ?",
+            (*fields.values(), key_id(key))
+        )
+
+    def get_health(self, key):
+        row = self._connection().execute(
+            "SELECT cooldown_until, consecutive_failures, latency_ewma, successes, failures, rate_limited "
+            "FROM key_health WHERE key_id = ?", (key_id(key),)
+        ).fetchone()
+        return dict(zip(
+            ("cooldown_until", "consecutive_failures", "latency_ewma", "successes", "failures", "rate_limited"),
+            row or (0.0, 0, None, 0, 0, 0)
+        ))
+
+
+class KeyPool:
+    """Hands out API keys according to per-key budgets and observed health.
+
+    Each key has a requests-per-minute and optional tokens-per-minute budget.
+    Keys that return 429/503 are put on an exponentially growing cooldown.
+    Among the keys that are usable right now, selection favors the least
+    loaded: fewest in-flight calls weighted by the key's latency EWMA and how
+    much of its minute budget is already spent.
+
+    Budgets and health live in ``store``; with a SQLiteKeyStore they are
+    shared by every process using the same file. In-flight counts stay per
+    process, so a worker that dies mid-call never leaves a key looking busy.
+    """
+
+    def __init__(self, keys, rpm_limit=15, tpm_limit=None, cooldown_seconds=60,
+                 max_cooldown_seconds=600, ewma_alpha=0.2, default_latency=2.0, store=None):
+        self.keys = list(dict.fromkeys(keys))
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.ewma_alpha = ewma_alpha
+        self.default_latency = default_latency
+        self.store = store or MemoryKeyStore()
+        self._in_flight = dict.fromkeys(self.keys, 0)
+        self._lock = threading.Lock()
+
+    def _available_in(self, usage, now, estimated_tokens):
+        """Seconds until this key can take another request (0 if it can now)"""
+        wait = max(usage["cooldown_until"] - now, 0)
+        if self.rpm_limit and usage["requests"] >= self.rpm_limit:
+            wait = max(wait, usage["requests_reset"])
+        if self.tpm_limit and usage["tokens"] and usage["tokens"] + estimated_tokens > self.tpm_limit:
+            wait = max(wait, usage["tokens_reset"])
+        return wait
+
+    def _score(self, key, usage, prior_latency):
+        latency = prior_latency if usage["latency_ewma"] is None else max(usage["latency_ewma"], 0.01)
+        budget_used = usage["requests"] / self.rpm_limit if self.rpm_limit else 0
+        return (self._in_flight[key] + 1) * latency * (1 + budget_used)
+
+    def try_acquire(self, exclude=(), estimated_tokens=0):
+        """Lease the least-loaded usable key, or return (None, seconds_until_one_frees_up)"""
+        now = time.time()
+        with self._lock, self.store.transaction():
+            snapshot = self.store.load(self.keys, now)
+            candidates = []
+            soonest = None
+            for key, usage in snapshot.items():
+                wait = self._available_in(usage, now, estimated_tokens)
+                if wait <= 0:
+                    candidates.append(key)
+                elif soonest is None or wait < soonest:
+                    soonest = wait
+
+            if not candidates:
+                return None, soonest if soonest is not None else self.cooldown_seconds
+
+            # Prefer keys the caller hasn't tried yet, but don't fail if only those remain
+            preferred = [key for key in candidates if key not in exclude] or candidates
+            # Keys without latency samples yet are assumed to be as fast as the pool average
+            known = [usage["latency_ewma"] for usage in snapshot.values() if usage["latency_ewma"] is not None]
+            prior = sum(known) / len(known) if known else self.default_latency
+            scores = {key: self._score(key, snapshot[key], prior) for key in preferred}
+            best_score = min(scores.values())
+            best = [key for key, score in scores.items() if score <= best_score * 1.05]
+            key = random.choice(best)
+
+            self.store.record_usage(key, now, requests=1, tokens=estimated_tokens)
+            self._in_flight[key] += 1
+            return key, 0
+
+    def next_available_in(self, exclude=(), estimated_tokens=0):
+        """Seconds until a key outside exclude could be leased (0 if one can now), without leasing it"""
+        now = time.time()
+        with self._lock, self.store.transaction():
+            snapshot = self.store.load(self.keys, now)
+        waits = [self._available_in(usage, now, estimated_tokens)
+                 for key, usage in snapshot.items() if key not in exclude]
+        if not waits:
+            # Every key was excluded; lease() would fall back to them too
+            waits = [self._available_in(usage, now, estimated_tokens) for usage in snapshot.values()]
+        return min(waits) if waits else self.cooldown_seconds
+
+    def acquire(self, exclude=(), estimated_tokens=0, timeout=30):
+        """Lease a key, waiting up to timeout seconds; raises NoKeyAvailable"""
+        deadline = time.time() + timeout
+        while True:
+            key, wait = self.try_acquire(exclude, estimated_tokens)
+            if key is not None:
+                return key
+            if time.time() + wait > deadline:
+                raise NoKeyAvailable(wait)
+            logger.warning(f"All API keys are busy or rate-limited. Waiting {wait:.2f} seconds...")
+            time.sleep(wait)
+
+    async def _offload(self, method, *args, **kwargs):
+        """Await a store-backed method without blocking the event loop.
+
+        SQLite transactions can wait on other processes' locks, so they run in
+        a worker thread; the in-memory store is cheap enough to call inline.
+        """
+        if isinstance(self.store, MemoryKeyStore):
+            return method(*args, **kwargs)
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    def _release_abandoned(self, task):
+        """Done callback for a try_acquire whose caller was cancelled: give its key back"""
+        if task.cancelled() or task.exception() is not None:
+            return
+        key = task.result()[0]
+        if key is not None:
+            asyncio.get_running_loop().run_in_executor(None, self.release, key)
+
+    async def aacquire(self, exclude=(), estimated_tokens=0, timeout=30):
+        """Async acquire that waits on the event loop instead of blocking a thread"""
+        deadline = time.time() + timeout
+        while True:
+            task = asyncio.ensure_future(self._offload(self.try_acquire, exclude, estimated_tokens))
+            try:
+                key, wait = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # The worker thread may still lease a key; hand it back once it does
+                task.add_done_callback(self._release_abandoned)
+                raise
+            if key is not None:
+                return key
+            if time.time() + wait > deadline:
+                raise NoKeyAvailable(wait)
+            await asyncio.sleep(wait)
+
+    def release(self, key, latency=None, error=None, tokens=0):
+        """Return a leased key, recording latency on success or the failure cause"""
+        if key not in self._in_flight:
+            return
+        now = time.time()
+        with self._lock, self.store.transaction():
+            self._in_flight[key] = max(self._in_flight[key] - 1, 0)
+            if tokens:
+                self.store.record_usage(key, now, requests=0, tokens=tokens)
+
+            health = self.store.get_health(key)
+            if error is None:
+                fields = {"successes": health["successes"] + 1, "consecutive_failures": 0}
+                if latency is not None:
+                    previous = health["latency_ewma"]
+                    if previous is None:
+                        fields["latency_ewma"] = latency
+                    else:
+                        fields["latency_ewma"] = previous + self.ewma_alpha * (latency - previous)
+                self.store.update_health(key, **fields)
+                return
+
+            fields = {"failures": health["failures"] + 1}
+            if is_rate_limit_error(error):
+                consecutive = health["consecutive_failures"] + 1
+                cooldown = min(self.cooldown_seconds * 2 ** (consecutive - 1), self.max_cooldown_seconds)
+                fields.update({
+                    "rate_limited": health["rate_limited"] + 1,
+                    "consecutive_failures": consecutive,
+                    "cooldown_until": max(health["cooldown_until"], now + cooldown)
+                })
+                logger.warning(f"Disabled API key {mask_key(key)} for {cooldown} seconds due to rate limiting")
+            self.store.update_health(key, **fields)
+
+    def pick(self, exclude=(), timeout=30):
+        """Key for callers that can't report back; counts against its budget only"""
+        key = self.acquire(exclude, timeout=timeout)
+        with self._lock:
+            self._in_flight[key] = max(self._in_flight[key] - 1, 0)
+        return key
+
+    def disable(self, key, seconds=None):
+        """Put a key on cooldown explicitly"""
+        if key not in self._in_flight:
+            return
+        with self._lock, self.store.transaction():
+            self.store.update_health(key, cooldown_until=time.time() + (seconds or self.cooldown_seconds))
+
+    @contextlib.contextmanager
+    def lease(self, exclude=(), estimated_tokens=0, timeout=30):
+        """Context manager that leases a key and reports the outcome of the block"""
+        key = self.acquire(exclude, estimated_tokens, timeout)
+        start = time.monotonic()
+        try:
+            yield key
+        except BaseException as e:
+            self.release(key, error=e)
+            raise
+        self.release(key, latency=time.monotonic() - start)
+
+    @contextlib.asynccontextmanager
+    async def alease(self, exclude=(), estimated_tokens=0, timeout=30):
+        key = await self.aacquire(exclude, estimated_tokens, timeout)
+        start = time.monotonic()
+        try:
+            yield key
+        except BaseException as e:
+            await self._offload(self.release, key, error=e)
+            raise
+        await self._offload(self.release, key, latency=time.monotonic() - start)
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock, self.store.transaction():
+            snapshot = self.store.load(self.keys, now)
+            keys = [{
+                "key": mask_key(key),
+                "in_flight": self._in_flight[key],
+                "requests_last_minute": usage["requests"],
+                "tokens_last_minute": usage["tokens"],
+                "latency_ewma": None if usage["latency_ewma"] is None else round(usage["latency_ewma"], 3),
+                "cooldown_remaining": round(max(usage["cooldown_until"] - now, 0), 1),
+                "successes": usage["successes"],
+                "failures": usage["failures"],
+                "rate_limited": usage["rate_limited"]
+            } for key, usage in snapshot.items()]
+        return {
+            "store": type(self.store).__name__,
+            "rpm_limit": self.rpm_limit,
+            "tpm_limit": self.tpm_limit,
+            "available": sum(1 for entry in keys if entry["cooldown_remaining"] == 0),
+            "keys": keys
+        }
+
+
+class PerKeyCache:
+    """Builds one object per key (client, LLM, chain) on first use and reuses it.
+
+    ``factory(key)`` runs at most once per key, even when several threads
+    ask for the same key at once; every later call returns that instance.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            with self._lock:
+                item = self._items.get(key)
+                if item is None:
+                    item = self._items[key] = self.factory(key)
+        return item
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LeasedChain:
+    """Chain that leases a key from ``pool`` around every run.
+
+    ``build(key)`` returns a chain bound to that key, typically
+    ``PerKeyCache.get``. Each call's latency or failure is reported back to
+    the pool, so 429s cool the key down like any other leased call.
+    """
+
+    def __init__(self, pool, build):
+        self.pool = pool
+        self.build = build
+
+    def run(self, **kwargs):
+        with self.pool.lease() as key:
+            return self.build(key).run(**kwargs)
+
+
+def create_key_pool(keys, **kwargs):
+    """KeyPool whose state is shared through the KEY_POOL_PATH SQLite file.
+
+    Set KEY_POOL_PATH to an empty string to keep state in this process only.
+    Falls back to the in-memory store if the file can't be opened.
+    """
+    db_path = os.environ.get("KEY_POOL_PATH", "key_pool.sqlite3")
+    store = None
+    if db_path:
+        try:
+            store = SQLiteKeyStore(db_path)
+        except sqlite3.Error as e:
+            logger.error(f"Disabling shared key pool state at {db_path}: {str(e)}")
+    return KeyPool(keys, store=store, **kwargs)
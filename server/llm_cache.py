@@ -0,0 +1,223 @@
+# llm_cache.py - Content-addressed cache for LLM responses
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache:
+    """Two-tier cache for LLM completions keyed on the rendered prompt.
+
+    Lookups check an in-memory LRU first and then an optional SQLite file, so
+    cached responses survive restarts and are shared by every worker process
+    on the host. Entries expire after their TTL in both tiers.
+    """
+
+    def __init__(self, max_entries=1024, db_path=None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+        if db_path:
+            try:
+                self._connection().execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._connection().commit()
+            except sqlite3.Error as e:
+                logger.error(f"Disabling on-disk LLM cache at {db_path}: {str(e)}")
+                self.db_path = None
+
+    @staticmethod
+    def make_key(prompt, model, temperature):
+        """Hash of everything that determines the completion"""
+        material = f"{model}\x00{temperature}\x00{prompt}".encode("utf-8")
+        return hashlib.sha256(material).hexdigest()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _get_memory(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+        return None
+
+    def _get_disk(self, key):
+        """SQLite tier of get; counts the miss when neither tier has the key"""
+        if self.db_path:
+            try:
+                row = self._connection().execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time())
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Error reading LLM cache: {str(e)}")
+                row = None
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                return row[0]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def get(self, key):
+        """Cached value for key, or None on a miss or expiry"""
+        value = self._get_memory(key)
+        return value if value is not None else self._get_disk(key)
+
+    async def aget(self, key):
+        """Async get: the in-memory LRU is checked inline, SQLite in a worker thread"""
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        if not self.db_path:
+            # Only counts the miss
+            return self._get_disk(key)
+        return await asyncio.to_thread(self._get_disk, key)
+
+    def _set_memory(self, key, value, ttl):
+        """Memory tier of set; returns (expires_at, purge) for the disk write"""
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        with self._lock:
+            self._stats["writes"] += 1
+            purge = self._stats["writes"] % 100 == 0
+        return expires_at, purge
+
+    def _set_disk(self, key, value, expires_at, purge):
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            if purge:
+                connection.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            connection.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing LLM cache: {str(e)}")
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds in both tiers"""
+        expires_at, purge = self._set_memory(key, value, ttl)
+        if self.db_path:
+            self._set_disk(key, value, expires_at, purge)
+
+    async def aset(self, key, value, ttl):
+        """Async set that writes SQLite in a worker thread"""
+        expires_at, purge = self._set_memory(key, value, ttl)
+        if self.db_path:
+            await asyncio.to_thread(self._set_disk, key, value, expires_at, purge)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["disk_path"] = self.db_path
+        return stats
+
+
+class CachedChain:
+    """Wraps a chain so identical rendered prompts are answered from the cache.
+
+    With ``validate`` set, only completions it accepts are cached, so a
+    malformed answer is retried next time instead of being replayed.
+    """
+
+    def __init__(self, chain, cache, ttl, model, temperature=None, validate=None):
+        self.chain = chain
+        self.cache = cache
+        self.ttl = ttl
+        self.model = model
+        self.temperature = temperature
+        self.validate = validate
+
+    @property
+    def prompt(self):
+        return self.chain.prompt
+
+    def _cacheable(self, result):
+        if self.validate is None or self.validate(result):
+            return True
+        logger.info("Not caching a completion that failed validation")
+        return False
+
+    def run(self, **kwargs):
+        key = self.cache.make_key(self.chain.prompt.format(**kwargs), self.model, self.temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        result = self.chain.run(**kwargs)
+        if self._cacheable(result):
+            self.cache.set(key, result, self.ttl)
+        return result
+
+    def stream(self, on_token, **kwargs):
+        """Stream the completion through on_token; a cache hit arrives as one chunk"""
+        key = self.cache.make_key(self.chain.prompt.format(**kwargs), self.model, self.temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            on_token(cached)
+            return cached
+
+        result = self.chain.stream(on_token, **kwargs)
+        if self._cacheable(result):
+            self.cache.set(key, result, self.ttl)
+        return result
+
+    async def arun(self, **kwargs):
+        key = self.cache.make_key(self.chain.prompt.format(**kwargs), self.model, self.temperature)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            return cached
+
+        result = await self.chain.arun(**kwargs)
+        if self._cacheable(result):
+            await self.cache.aset(key, result, self.ttl)
+        return result
+
+
+def create_default_cache():
+    """Cache configured from LLM_CACHE_* environment variables, or None if disabled"""
+    if os.environ.get("LLM_CACHE_DISABLED") == "1":
+        return None
+    db_path = os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite3") or None
+    return LLMResponseCache(
+        max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1024)),
+        db_path=db_path
+    )
@@ -0,0 +1,117 @@
+# model_registry.py - Process-wide registry for heavyweight ML models
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SENTIMENT_MODEL_NAME = "distilbert-base-uncased-finetuned-sst-2-english"
+
+
+def _peak_rss_bytes():
+    """Peak resident set size of this process in bytes, or None if unavailable"""
+    try:
+        import resource
+        import sys
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _parameter_bytes(model):
+    """Size of a torch model's parameters in bytes, or None for non-torch objects"""
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except Exception:
+        return None
+
+
+class ModelRegistry:
+    """Loads each registered model once per process and shares it across threads.
+
+    Loading is lazy (first ``get``) or eager via ``warm_up``. Every entry also
+    carries an inference lock, because HuggingFace pipelines and their fast
+    tokenizers are not safe to call from several threads at once.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._locks = {}
+        self._stats = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name, loader):
+        """Register a zero-argument loader callable under ``name``"""
+        with self._registry_lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+            self._stats.setdefault(name, {"status": "not_loaded"})
+
+    def get(self, name):
+        """Return the shared model, loading it on first use; None if loading failed"""
+        if name in self._models:
+            return self._models[name]
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited
+            if name in self._models:
+                return self._models[name]
+
+            rss_before = _peak_rss_bytes()
+            start = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                logger.error(f"Error loading model {name}: {str(e)}")
+                model = None
+            load_seconds = time.perf_counter() - start
+            rss_after = _peak_rss_bytes()
+
+            self._stats[name] = {
+                "status": "loaded" if model is not None else "failed",
+                "load_seconds": round(load_seconds, 3),
+                "loaded_at": time.time(),
+                "parameter_bytes": _parameter_bytes(getattr(model, "model", model)),
+                "peak_rss_delta_bytes": (rss_after - rss_before) if rss_before is not None else None,
+                "calls": 0
+            }
+            logger.info(f"Loaded model {name} in {load_seconds:.2f}s")
+
+            # A failed load is cached as None so requests don't retry it every time
+            self._models[name] = model
+            return model
+
+    def inference_lock(self, name):
+        """Lock that serializes calls into the shared model ``name``"""
+        return self._locks[name]
+
+    def record_call(self, name, count=1):
+        """Count inference calls made against ``name``"""
+        stats = self._stats.get(name)
+        if stats is not None and "calls" in stats:
+            stats["calls"] += count
+
+    def warm_up(self, names=None):
+        """Eagerly load the given models (all registered models by default)"""
+        for name in names or list(self._loaders):
+            self.get(name)
+
+    def get_stats(self):
+        """Snapshot of load time and memory stats for every registered model"""
+        with self._registry_lock:
+            stats = {name: dict(entry) for name, entry in self._stats.items()}
+        stats["process_peak_rss_bytes"] = _peak_rss_bytes()
+        return stats
+
+
+def _load_sentiment_pipeline():
+    from transformers import pipeline
+    return pipeline("sentiment-analysis", model=SENTIMENT_MODEL_NAME)
+
+
+model_registry = ModelRegistry()
+model_registry.register("sentiment", _load_sentiment_pipeline)
@@ -0,0 +1,250 @@
+# retry_scheduler.py - Retry with backoff on an event loop instead of sleeping threads
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from key_pool import NoKeyAvailable
+
+logger = logging.getLogger(__name__)
+
+
+class RetryExhausted(Exception):
+    """Every attempt failed; ``last_error`` is the final failure"""
+
+    def __init__(self, last_error):
+        super().__init__(f"All attempts failed: {last_error}")
+        self.last_error = last_error
+
+
+class JobStore:
+    """Job status and results in SQLite, so any worker process can answer a poll.
+
+    A job is recorded as pending when submitted and updated with its result
+    (JSON) or error when it finishes. Rows older than the scheduler's job TTL
+    are purged; that also clears jobs whose worker died before finishing.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS retry_jobs ("
+            "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, error TEXT, created REAL NOT NULL)"
+        )
+        connection.commit()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def create(self, job_id, created):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO retry_jobs (job_id, status, created) VALUES (?, 'pending', ?)",
+            (job_id, created)
+        )
+        connection.commit()
+
+    def finish(self, job_id, result=None, error=None):
+        connection = self._connection()
+        if error is None:
+            connection.execute(
+                "UPDATE retry_jobs SET status = 'done', result = ? WHERE job_id = ?", (json.dumps(result), job_id)
+            )
+        else:
+            connection.execute(
+                "UPDATE retry_jobs SET status = 'failed', error = ? WHERE job_id = ?", (str(error), job_id)
+            )
+        connection.commit()
+
+    def get(self, job_id):
+        row = self._connection().execute(
+            "SELECT status, result, error FROM retry_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "result": json.loads(row[1]) if row[1] is not None else None, "error": row[2]}
+
+    def purge(self, older_than):
+        connection = self._connection()
+        connection.execute("DELETE FROM retry_jobs WHERE created < ?", (older_than,))
+        connection.commit()
+
+
+def create_job_store():
+    """JobStore at JOB_STORE_PATH, or None (jobs visible to this process only) if unset or unusable"""
+    db_path = os.environ.get("JOB_STORE_PATH", "retry_jobs.sqlite3")
+    if not db_path:
+        return None
+    try:
+        return JobStore(db_path)
+    except sqlite3.Error as e:
+        logger.error(f"Disabling shared job store at {db_path}: {str(e)}")
+        return None
+
+
+class RetryScheduler:
+    """Runs jobs on a background event loop, retrying their blocking calls.
+
+    Each attempt runs on a bounded worker pool; between attempts the job is
+    parked with ``asyncio.sleep`` and holds no thread. Backoff is full
+    jitter, shaped by the shared key pool: when a healthy key the job hasn't
+    tried is free, the retry goes out almost at once on that key; when none
+    is, the job waits until the pool says one frees up. One overloaded key
+    therefore delays only the attempt that hit it, not every request.
+
+    Jobs get an id so a request can hand back 202 and let the client poll.
+    With a ``job_store``, their status is shared so the poll can land on any
+    worker process; without one, only this process knows about its jobs.
+    """
+
+    def __init__(self, name, key_pool=None, workers=8, base_delay=1.0, max_delay=30.0, job_ttl=600,
+                 job_store=None):
+        self.name = name
+        self.key_pool = key_pool
+        self.job_store = job_store
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.job_ttl = job_ttl
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._loop = None
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._stats = {"jobs": 0, "attempts": 0, "retries": 0, "exhausted": 0, "parked_seconds": 0.0}
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name=f"{self.name}-scheduler", daemon=True
+                ).start()
+            return self._loop
+
+    def submit(self, coroutine_function, *args):
+        """Start ``coroutine_function(*args)`` on the scheduler loop; returns (job_id, future)"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        if self.job_store is not None:
+            try:
+                self.job_store.create(job_id, now)
+                if self._stats["jobs"] % 100 == 0:
+                    self.job_store.purge(now - self.job_ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"Error recording {self.name} job: {str(e)}")
+        future = asyncio.run_coroutine_threadsafe(coroutine_function(*args), self._get_loop())
+        with self._lock:
+            self._stats["jobs"] += 1
+            self._jobs[job_id] = (future, now)
+            # Forget finished jobs nobody came back for
+            for stale_id, (stale, created) in list(self._jobs.items()):
+                if stale.done() and now - created > self.job_ttl:
+                    del self._jobs[stale_id]
+        if self.job_store is not None:
+            # Done callbacks run on the scheduler loop; keep the SQLite write off it
+            future.add_done_callback(lambda done: self._executor.submit(self._record, job_id, done))
+        return job_id, future
+
+    def _record(self, job_id, future):
+        try:
+            if future.cancelled():
+                self.job_store.finish(job_id, error="cancelled")
+            elif future.exception() is not None:
+                self.job_store.finish(job_id, error=future.exception())
+            else:
+                self.job_store.finish(job_id, result=future.result())
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Error recording {self.name} job result: {str(e)}")
+
+    def get(self, job_id):
+        """The job's concurrent.futures.Future, or None if unknown here or expired"""
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        return entry[0] if entry else None
+
+    def status(self, job_id):
+        """{"status": "pending" | "done" | "failed", "result", "error"} for a job, or None if unknown.
+
+        Jobs submitted by other worker processes are found through the job store.
+        """
+        future = self.get(job_id)
+        if future is not None:
+            if not future.done():
+                return {"status": "pending", "result": None, "error": None}
+            if future.cancelled() or future.exception() is not None:
+                error = "cancelled" if future.cancelled() else str(future.exception())
+                return {"status": "failed", "result": None, "error": error}
+            return {"status": "done", "result": future.result(), "error": None}
+        if self.job_store is None:
+            return None
+        try:
+            return self.job_store.get(job_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading {self.name} job: {str(e)}")
+            return None
+
+    def _delay(self, attempt, exclude, error):
+        """Seconds to park before the next attempt"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if isinstance(error, NoKeyAvailable):
+            return error.retry_after + random.uniform(0, self.base_delay)
+        if self.key_pool is None:
+            return backoff
+        wait = self.key_pool.next_available_in(exclude)
+        if wait <= 0:
+            # Another key is healthy right now; only jitter so retries don't stampede it
+            return min(backoff, self.base_delay)
+        return wait + random.uniform(0, self.base_delay)
+
+    async def run_blocking(self, function, *args):
+        """Await ``function(*args)`` on the worker pool, keeping blocking work off the scheduler loop"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def retry(self, attempt, *args, max_attempts=5):
+        """Await ``attempt(*args, exclude)`` on the worker pool until it succeeds.
+
+        ``attempt`` adds the key it leases to ``exclude`` so later attempts
+        prefer other keys. Raises RetryExhausted after max_attempts failures.
+        """
+        exclude = set()
+        for number in range(max_attempts):
+            with self._lock:
+                self._stats["attempts"] += 1
+            try:
+                return await self.run_blocking(attempt, *args, exclude)
+            except Exception as e:
+                error = e
+                logger.error(f"{self.name} attempt {number + 1}/{max_attempts} failed: {str(e)}")
+            if number < max_attempts - 1:
+                # The key pool lookup is a SQLite transaction that can wait on other processes
+                delay = await self.run_blocking(self._delay, number, exclude, error)
+                logger.info(f"Retrying {self.name} call in {delay:.2f} seconds...")
+                with self._lock:
+                    self._stats["retries"] += 1
+                    self._stats["parked_seconds"] += delay
+                await asyncio.sleep(delay)
+
+        with self._lock:
+            self._stats["exhausted"] += 1
+        raise RetryExhausted(error)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending_jobs"] = sum(1 for future, _ in self._jobs.values() if not future.done())
+        stats["parked_seconds"] = round(stats["parked_seconds"], 1)
+        return stats
@@ -0,0 +1,99 @@
+# structured_output.py - Parse JSON answers out of LLM completions
+
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+
+
+class StructuredOutputError(ValueError):
+    """The completion didn't contain the JSON shape we asked for"""
+
+
+def extract_json(text):
+    """Decode the JSON value in a completion, tolerating code fences and chatter around it"""
+    text = _FENCE.sub("", text.strip())
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    # Fall back to the outermost object or array embedded in prose
+    for opener, closer in (("{", "}"), ("[", "]")):
+        start, end = text.find(opener), text.rfind(closer)
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except json.JSONDecodeError:
+                continue
+    raise StructuredOutputError(f"No JSON found in completion: {text[:80]!r}")
+
+
+def parse_string_list(text, key, max_items=None):
+    """The non-empty strings under ``key`` (or a bare JSON array) in a completion"""
+    value = extract_json(text)
+    if isinstance(value, dict):
+        if key not in value:
+            raise StructuredOutputError(f"Completion JSON has no {key!r} field")
+        value = value[key]
+    if not isinstance(value, list):
+        raise StructuredOutputError(f"Expected a list under {key!r}, got {type(value).__name__}")
+
+    items = [item.strip() for item in value if isinstance(item, str) and item.strip()]
+    if not items:
+        raise StructuredOutputError(f"No usable strings under {key!r}")
+    return items[:max_items] if max_items else items
+
+
+def is_string_list(text, key, count=None):
+    """True if parse_string_list accepts the completion (with exactly count items, if given)"""
+    try:
+        items = parse_string_list(text, key)
+    except StructuredOutputError:
+        return False
+    return count is None or len(items) == count
+
+
+# "1.", "2)", "1/", "-" or "*" followed by a space, or "Tweet 1:", at the start of
+# a line; "2025: ..." and "3.5 million" are content, not numbering
+_LIST_MARKER = re.compile(
+    r"^\s*(?:tweet\s*\d{1,2}\s*[.):/]\s*|\d{1,2}\s*[.)/]\s+|[-*•]\s+)", re.IGNORECASE
+)
+_JSON_KEY = re.compile(r'^"\w+"\s*:\s*[\[{]?$')
+# A complete JSON string literal; group 2 is set when it's an object key
+_JSON_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"(\s*:)?')
+
+
+def salvage_lines(text, max_items=None):
+    """Best-effort list from a non-JSON completion: one item per line, minus numbering and blanks.
+
+    A completion that starts out as JSON but doesn't parse (e.g. truncated)
+    yields only its complete string values, so no braces or keys leak through.
+    """
+    text = _FENCE.sub("", text.strip())
+    if text.startswith(("{", "[")):
+        items = []
+        for match in _JSON_STRING.finditer(text):
+            if match.group(2):
+                continue
+            try:
+                item = _LIST_MARKER.sub("", json.loads(f'"{match.group(1)}"')).strip()
+            except json.JSONDecodeError:
+                continue
+            if item:
+                items.append(item)
+        return items[:max_items] if max_items else items
+
+    items = []
+    for line in text.splitlines():
+        line = line.strip().rstrip(",").strip()
+        # Skip blanks and the keys and brackets of a half-formed JSON object
+        if not line.strip("{}[],") or _JSON_KEY.match(line):
+            continue
+        line = _LIST_MARKER.sub("", line.strip('"')).strip()
+        if line:
+            items.append(line)
+    return items[:max_items] if max_items else items
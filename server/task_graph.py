@@ -0,0 +1,119 @@
+# task_graph.py - Run dependent tasks concurrently as their inputs become ready
+
+import concurrent.futures
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often a cancellable run checks its cancel event while tasks are running
+CANCEL_POLL_SECONDS = 0.5
+
+# Marker for tasks whose failure should abort the whole graph
+REQUIRED = object()
+
+
+class TaskGraphError(Exception):
+    """A required task failed or timed out"""
+
+
+class TaskGraph:
+    """A small dependency graph of named tasks.
+
+    Each task is started as soon as every task it depends on has finished, and
+    receives their results as keyword arguments named after them. Independent
+    tasks therefore run concurrently and total latency tracks the critical
+    path. A task that raises or exceeds its timeout resolves to its default
+    value; tasks added without a default abort the run with TaskGraphError.
+    """
+
+    def __init__(self, max_workers=8, name="task-graph"):
+        self.max_workers = max_workers
+        self.name = name
+        self._tasks = {}
+        self.timings = {}
+
+    def add(self, name, func, deps=(), timeout=None, default=REQUIRED):
+        if name in self._tasks:
+            raise ValueError(f"Task {name} already added")
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        self._tasks[name] = {"func": func, "deps": tuple(deps), "timeout": timeout, "default": default}
+
+    def _resolve_failure(self, name, reason):
+        default = self._tasks[name]["default"]
+        if default is REQUIRED:
+            raise TaskGraphError(f"Task {name} {reason}")
+        logger.warning(f"Task {name} {reason}, using default")
+        return default
+
+    def run(self, on_complete=None, cancel_event=None):
+        """Execute every task and return a dict of results by task name.
+
+        ``on_complete(name, result)`` is called from the coordinating thread as
+        each task settles, which lets callers stream partial results. Setting
+        ``cancel_event`` stops new tasks from starting and raises TaskGraphError.
+        """
+        results = {}
+        running = {}
+        submitted = set()
+        started = time.monotonic()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix=self.name
+        )
+
+        def settle(name, result):
+            results[name] = result
+            self.timings[name] = round(time.monotonic() - started, 3)
+            if on_complete:
+                on_complete(name, result)
+
+        try:
+            while len(results) < len(self._tasks):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise TaskGraphError("Task graph cancelled")
+
+                # Start every task whose dependencies have all settled
+                for name, task in self._tasks.items():
+                    if name in submitted:
+                        continue
+                    if all(dep in results for dep in task["deps"]):
+                        submitted.add(name)
+                        kwargs = {dep: results[dep] for dep in task["deps"]}
+                        future = executor.submit(task["func"], **kwargs)
+                        deadline = time.monotonic() + task["timeout"] if task["timeout"] else None
+                        running[future] = (name, deadline)
+
+                if not running:
+                    raise TaskGraphError("Dependency cycle in task graph")
+
+                deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+                wait_for = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+                if cancel_event is not None:
+                    # Wake up periodically to notice cancellation
+                    wait_for = CANCEL_POLL_SECONDS if wait_for is None else min(wait_for, CANCEL_POLL_SECONDS)
+                done, _ = concurrent.futures.wait(
+                    running, timeout=wait_for, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    name, _ = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = self._resolve_failure(name, f"failed: {str(e)}")
+                    settle(name, result)
+
+                now = time.monotonic()
+                for future, (name, deadline) in list(running.items()):
+                    if deadline is not None and now >= deadline and not future.done():
+                        # The worker thread can't be killed; abandon its result
+                        future.cancel()
+                        running.pop(future)
+                        settle(name, self._resolve_failure(name, "timed out"))
+
+            return results
+        finally:
+            # Don't block the caller on abandoned tasks that are still running
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -1,7 +1,12 @@
 from flask import Flask, request, jsonify
-import requests
+import os
+import sys
 from flask_cors import CORS
 
+# Outbound calls go through the pooled keep-alive session shared with the main server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from http_client import get_session
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
@@ -30,7 +35,7 @@ def start_call():
     }
 
     try:
-        response = requests.post(BLAND_API_URL, json=payload, headers=headers)
+        response = get_session().post(BLAND_API_URL, json=payload, headers=headers)
         return jsonify({
             "status_code": response.status_code,
             "response": response.json()